@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Load test and benchmark harness for the Fitness App backend.
+
+Runs the FastAPI app in-process against a local mongod (--mongo-url) or an
+in-memory mongomock-motor database, seeds workout sessions and measurements,
+drives each route concurrently and writes p50/p95/p99 latency, throughput
+and peak RSS to a JSON file that can be diffed between commits.
+
+With --workers the seeded app is instead served by `uvicorn --workers N`
+for each N in turn and driven over real HTTP from --client-processes load
+generator processes, to show how throughput scales with worker count.
+
+Usage:
+    python benchmark.py --sessions 10000 --output bench.json
+    python benchmark.py --mongo-url mongodb://localhost:27017 --sessions 1000000
+    python benchmark.py --compare bench-before.json --output bench-after.json
+    python benchmark.py --routes exercise_search --check-targets
+    python benchmark.py --catalog-size 5000 --routes exercise_search
+    python benchmark.py --mongo-url mongodb://localhost:27017 --workers 1,2,4,8
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+BENCH_DB_NAME = "fitness_benchmark"
+SEED_BATCH_SIZE = 5000
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_READY_TIMEOUT = 60
+# p95 budgets (ms) for routes that serve type-ahead, checked with --check-targets
+LATENCY_TARGETS = {
+    "exercise_search": 5.0,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fitness App backend benchmark")
+    parser.add_argument("--mongo-url", help="Benchmark against this mongod instead of mongomock-motor")
+    parser.add_argument("--sessions", type=int, default=10000, help="Workout sessions to seed")
+    parser.add_argument("--measurements", type=int, default=10000, help="Measurements to seed")
+    parser.add_argument("--users", type=int, default=1, help="Spread seeded data across this many users")
+    parser.add_argument("--days", type=int, default=365, help="Spread seeded data over this many days")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per route")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent clients per route")
+    parser.add_argument("--routes", help="Comma-separated subset of route names to run")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for generated data")
+    parser.add_argument("--output", default="bench.json", help="Where to write the JSON report")
+    parser.add_argument("--compare", help="Previous JSON report to print deltas against")
+    parser.add_argument("--check-targets", action="store_true",
+                        help="Exit non-zero if a route misses its p95 target in LATENCY_TARGETS")
+    parser.add_argument("--catalog-size", type=int,
+                        help="Seed a synthetic exercise catalog of this many entries instead of the shipped one")
+    parser.add_argument("--workers", help="Comma-separated uvicorn worker counts to compare (needs --mongo-url)")
+    parser.add_argument("--client-processes", type=int, default=os.cpu_count() or 1,
+                        help="Load generator processes used with --workers")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the uvicorn server used with --workers")
+    args = parser.parse_args(argv)
+    if args.workers and not args.mongo_url:
+        parser.error("--workers needs --mongo-url: worker processes cannot share an in-memory database")
+    return args
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def user_ids(count):
+    return ["default"] + [f"bench-user-{i}" for i in range(1, count)]
+
+
+def generate_sessions(rng, count, users, days, exercise_ids, now):
+    for _ in range(count):
+        created_at = now - timedelta(seconds=rng.uniform(0, days * 86400))
+        exercise_id = rng.choice(exercise_ids)
+        duration = rng.randint(60, 3600)
+        yield {
+            "_id": str(uuid.uuid4()),
+            "user_id": rng.choice(users),
+            "date": created_at.date().isoformat(),
+            "exercises_completed": [
+                {"exercise_id": exercise_id, "sets_completed": 3, "total_duration": duration}
+            ],
+            "total_duration": duration,
+            "difficulty_rating": rng.randint(1, 5),
+            "energy_level": rng.randint(1, 5),
+            "notes": None,
+            "created_at": created_at,
+        }
+
+
+def generate_measurements(rng, count, users, days, now):
+    for _ in range(count):
+        created_at = now - timedelta(seconds=rng.uniform(0, days * 86400))
+        yield {
+            "_id": str(uuid.uuid4()),
+            "user_id": rng.choice(users),
+            "measurement": round(rng.uniform(70, 110), 1),
+            "date": created_at.date().isoformat(),
+            "notes": None,
+            "created_at": created_at,
+        }
+
+
+async def insert_batched(server, collection, documents):
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= SEED_BATCH_SIZE:
+            await collection.insert_many(await server.stamp_sequences(batch), ordered=False)
+            batch = []
+    if batch:
+        await collection.insert_many(await server.stamp_sequences(batch), ordered=False)
+
+
+def write_synthetic_catalog(size):
+    """Write a catalog of `size` entries cycling through the shipped ones and return its path."""
+    with open(os.path.join(BACKEND_DIR, "exercise_catalog.json")) as f:
+        shipped = json.load(f)
+    exercises = []
+    for i in range(size):
+        base = shipped["exercises"][i % len(shipped["exercises"])]
+        suffix = i // len(shipped["exercises"])
+        exercises.append(base if not suffix else {
+            **base, "slug": f"{base['slug']}-{suffix}", "name": f"{base['name']} {suffix}",
+        })
+    handle, path = tempfile.mkstemp(prefix="exercise_catalog_", suffix=".json")
+    with os.fdopen(handle, "w") as f:
+        json.dump({"version": shipped["version"], "exercises": exercises}, f)
+    return path
+
+
+async def seed(server, args):
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    users = user_ids(args.users)
+
+    await server.ensure_indexes()
+    started = time.perf_counter()
+    await server.apply_exercise_catalog()
+    catalog_seconds = time.perf_counter() - started
+    exercise_ids = [e["_id"] for e in await server.db.exercises.find({}, {"_id": 1}).to_list(length=None)]
+
+    started = time.perf_counter()
+    await insert_batched(
+        server,
+        server.db.workout_sessions,
+        generate_sessions(rng, args.sessions, users, args.days, exercise_ids, now),
+    )
+    await insert_batched(
+        server,
+        server.db.measurements,
+        generate_measurements(rng, args.measurements, users, args.days, now),
+    )
+    seed_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await server.startup_event()
+    await server.rebuild_workout_stats()
+    await server.rebuild_exercise_stats()
+    startup_seconds = time.perf_counter() - started
+    return exercise_ids, seed_seconds, catalog_seconds, startup_seconds
+
+
+def route_specs(exercise_ids, now):
+    def new_session():
+        return {
+            "date": now.date().isoformat(),
+            "exercises_completed": [{"exercise_id": exercise_ids[0], "sets_completed": 3, "total_duration": 225}],
+            "total_duration": 225,
+            "difficulty_rating": 3,
+            "energy_level": 4,
+        }
+
+    return {
+        "exercises": ("GET", "/api/exercises", None),
+        "exercises_filtered": ("GET", "/api/exercises?exercise_type=abdominal", None),
+        "exercises_summary": ("GET", "/api/exercises?view=summary", None),
+        "exercise_search": ("GET", "/api/exercises/search?q=elevacion%20de%20pier", None),
+        "exercise_detail": ("GET", f"/api/exercises/{exercise_ids[0]}", None),
+        "exercise_stats": ("GET", f"/api/exercises/{exercise_ids[0]}/stats", None),
+        "dashboard": ("GET", "/api/dashboard", None),
+        "workouts_page": ("GET", "/api/workouts?limit=50", None),
+        "workouts_range": ("GET", f"/api/workouts?limit=50&from={(now - timedelta(days=30)).date()}", None),
+        "workout_stats": ("GET", "/api/workouts/stats", None),
+        "trends": ("GET", "/api/trends", None),
+        "series": ("GET", "/api/series/measurement?points=200", None),
+        "measurements_page": ("GET", "/api/measurements?limit=50", None),
+        "sync": ("GET", "/api/sync?limit=500", None),
+        "generate_plan": ("POST", "/api/plans/generate", None),
+        "leaderboard": ("GET", "/api/leaderboards/weekly_time", None),
+        "create_workout": ("POST", "/api/workouts", new_session),
+    }
+
+
+async def collect_latencies(client, method, path, body_factory, total, concurrency):
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            body = body_factory() if body_factory else None
+            started = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+            # A request served entirely from memory never yields; without this
+            # one worker would run its whole share before the others resume.
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors
+
+
+async def drive_route(client, method, path, body_factory, total, concurrency):
+    started = time.perf_counter()
+    latencies, errors = await collect_latencies(client, method, path, body_factory, total, concurrency)
+    return summarize(latencies, errors, total, time.perf_counter() - started)
+
+
+def summarize(latencies, errors, total, elapsed):
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 1),
+        "mean_ms": round(float(latencies_ms.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+    }
+
+
+def print_report(report, previous=None):
+    previous_routes = (previous or {}).get("routes", {})
+    print(f"\n{'route':<22}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, result in report["routes"].items():
+        line = (f"{name:<22}{result['throughput_rps']:>10}{result['p50_ms']:>10}"
+                f"{result['p95_ms']:>10}{result['p99_ms']:>10}{result['errors']:>8}")
+        before = previous_routes.get(name)
+        if before and before.get("p95_ms"):
+            change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+            line += f"   p95 {change:+.1f}% vs {previous.get('meta', {}).get('git_revision') or 'previous'}"
+        print(line)
+    print(f"\nPeak RSS: {report['peak_rss_mb']} MB")
+
+
+def missed_targets(report):
+    missed = {}
+    for name, target in LATENCY_TARGETS.items():
+        result = report["routes"].get(name)
+        if result and (result["errors"] or result["p95_ms"] > target):
+            missed[name] = result["p95_ms"]
+    return missed
+
+
+def print_scaling(scaling):
+    counts = list(scaling)
+    routes = list(scaling[counts[0]])
+    print(f"\n{'route':<22}" + "".join(f"{f'{n}w rps':>12}" for n in counts) + f"{'speedup':>10}")
+    for name in routes:
+        rps = [scaling[n][name]["throughput_rps"] for n in counts]
+        speedup = rps[-1] / rps[0] if rps[0] else 0
+        print(f"{name:<22}" + "".join(f"{value:>12}" for value in rps) + f"{speedup:>9.2f}x")
+
+
+def drive_http_route(base_url, name, exercise_ids, now, total, concurrency):
+    """Runs in a load generator process: drive one route over HTTP, return raw latencies."""
+    import httpx
+
+    method, path, body_factory = route_specs(exercise_ids, now)[name]
+
+    async def drive():
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+            return await collect_latencies(client, method, path, body_factory, total, concurrency)
+
+    return asyncio.run(drive())
+
+
+def wait_until_ready(base_url, process):
+    import httpx
+
+    deadline = time.monotonic() + SERVER_READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/api/", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"uvicorn did not become ready within {SERVER_READY_TIMEOUT}s")
+
+
+def run_scaling(args, names, exercise_ids):
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = {**os.environ, "MONGO_URL": args.mongo_url, "DB_NAME": BENCH_DB_NAME}
+    processes = max(1, args.client_processes)
+    # Split requests and connections across load generator processes
+    shares = [args.requests // processes + (i < args.requests % processes) for i in range(processes)]
+    concurrency = max(1, args.concurrency // processes)
+    now = datetime.now(timezone.utc)
+
+    scaling = {}
+    for workers in [int(n) for n in args.workers.split(",")]:
+        server_process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(args.port),
+             "--workers", str(workers), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env,
+        )
+        try:
+            wait_until_ready(base_url, server_process)
+            results = {}
+            with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+                for name in names:
+                    started = time.perf_counter()
+                    futures = [
+                        pool.submit(drive_http_route, base_url, name, exercise_ids, now, share, concurrency)
+                        for share in shares if share
+                    ]
+                    outcomes = [future.result() for future in futures]
+                    elapsed = time.perf_counter() - started
+                    latencies = [latency for outcome, _ in outcomes for latency in outcome]
+                    errors = sum(errors for _, errors in outcomes)
+                    results[name] = summarize(latencies, errors, args.requests, elapsed)
+            scaling[str(workers)] = results
+            print(f"Benchmarked {len(names)} routes with {workers} uvicorn worker(s)")
+        finally:
+            server_process.terminate()
+            server_process.wait()
+    return scaling
+
+
+async def run(args):
+    os.environ.setdefault("MONGO_URL", args.mongo_url or "mongodb://localhost:27017")
+    os.environ["DB_NAME"] = BENCH_DB_NAME
+    if args.catalog_size:
+        os.environ["EXERCISE_CATALOG_PATH"] = write_synthetic_catalog(args.catalog_size)
+    sys.path.insert(0, BACKEND_DIR)
+    import httpx
+    import server
+
+    if args.mongo_url:
+        server.connect_mongo()
+        await server.client.drop_database(BENCH_DB_NAME)
+        backend = "mongod"
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        server.db = AsyncMongoMockClient(tz_aware=True)[BENCH_DB_NAME]
+        backend = "mongomock-motor"
+
+    exercise_ids, seed_seconds, catalog_seconds, startup_seconds = await seed(server, args)
+    print(f"Seeded {len(exercise_ids)} exercises in {catalog_seconds:.2f}s, {args.sessions} sessions and "
+          f"{args.measurements} measurements into {backend} in {seed_seconds:.1f}s (startup {startup_seconds:.2f}s)")
+
+    specs = route_specs(exercise_ids, datetime.now(timezone.utc))
+    if args.routes:
+        wanted = set(args.routes.split(","))
+        specs = {name: spec for name, spec in specs.items() if name in wanted}
+
+    results = {}
+    if not args.workers:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            for name, (method, path, body_factory) in specs.items():
+                results[name] = await drive_route(client, method, path, body_factory, args.requests, args.concurrency)
+
+    await server.shutdown_db_client()
+    return list(specs), exercise_ids, {
+        "meta": {
+            "git_revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": backend,
+            "sessions": args.sessions,
+            "measurements": args.measurements,
+            "users": args.users,
+            "requests_per_route": args.requests,
+            "concurrency": args.concurrency,
+            "seed_seconds": round(seed_seconds, 3),
+            "catalog_size": len(exercise_ids),
+            "catalog_seconds": round(catalog_seconds, 3),
+            "startup_seconds": round(startup_seconds, 3),
+        },
+        "routes": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    names, exercise_ids, report = asyncio.run(run(args))
+    if args.workers:
+        report["scaling"] = run_scaling(args, names, exercise_ids)
+        report["meta"]["client_processes"] = args.client_processes
+        report["meta"]["cpu_count"] = os.cpu_count()
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    if args.workers:
+        print_scaling(report["scaling"])
+    else:
+        print_report(report, previous)
+    print(f"Wrote {args.output}")
+    if args.check_targets:
+        missed = missed_targets(report)
+        for name, p95 in missed.items():
+            print(f"{name}: p95 {p95} ms misses the {LATENCY_TARGETS[name]} ms target")
+        if missed:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Maintenance commands for the Fitness App backend.
+
+Usage:
+    python manage.py rebuild-stats
+    python manage.py verify-indexes
+    python manage.py rebuild-exercise-stats
+    python manage.py rebuild-snapshots
+    python manage.py generate-plans
+    python manage.py migrate-documents
+    python manage.py migrate
+    python manage.py apply-catalog
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+
+import server
+
+
+async def rebuild_stats():
+    await server.rebuild_workout_stats()
+    mismatches = await server.verify_workout_stats()
+    if mismatches:
+        logging.error(f"Workout stats rollup does not match live aggregate: {mismatches}")
+        return 1
+    logging.info("Workout stats rollup matches live aggregate")
+    return 0
+
+
+async def verify_indexes():
+    await server.ensure_indexes()
+    try:
+        await server.verify_query_plans()
+    except RuntimeError as e:
+        logging.error(str(e))
+        return 1
+    return 0
+
+
+async def rebuild_exercise_stats():
+    await server.rebuild_exercise_stats()
+    return 0
+
+
+async def rebuild_snapshots():
+    if not server.snapshot_store:
+        logging.error("COLUMNAR_SNAPSHOT_DIR is not set")
+        return 1
+    await server.rebuild_snapshots()
+    return 0
+
+
+async def generate_plans():
+    await server.generate_all_plans()
+    return 0
+
+
+async def migrate_documents():
+    await server.migrate_compact_documents()
+    return 0
+
+
+async def migrate():
+    await server.run_migrations()
+    return 0
+
+
+async def apply_catalog():
+    await server.apply_exercise_catalog()
+    return 0
+
+
+COMMANDS = {
+    "rebuild-stats": rebuild_stats,
+    "verify-indexes": verify_indexes,
+    "rebuild-exercise-stats": rebuild_exercise_stats,
+    "rebuild-snapshots": rebuild_snapshots,
+    "generate-plans": generate_plans,
+    "migrate-documents": migrate_documents,
+    "migrate": migrate,
+    "apply-catalog": apply_catalog,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fitness App maintenance commands")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args(argv)
+
+    server.connect_mongo()
+    try:
+        return asyncio.run(COMMANDS[args.command]())
+    finally:
+        server.close_mongo()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
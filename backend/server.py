@@ -1,23 +1,422 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response, Header, Depends
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import StreamingResponse, PlainTextResponse
+from starlette.datastructures import Headers, MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, ASCENDING, DESCENDING, UpdateOne, ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from pymongo import monitoring
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, Union
 import uuid
-from datetime import datetime, timezone
+import json
+import base64
+import time
+import asyncio
+import csv
+import io
+import zlib
+import threading
+import hashlib
+import math
+import re
+import unicodedata
+import fcntl
+import contextvars
+from contextlib import contextmanager
+from collections import OrderedDict
+import numpy as np
+import jwt
+from sortedcontainers import SortedList
+from datetime import date, datetime, timezone, timedelta
 from enum import Enum
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics
+# A small Prometheus-style registry, rendered in the text exposition format on
+# /metrics. Per-request figures (Mongo round trips, validation and
+# serialization time) accumulate on a RequestMetrics object held in a context
+# variable; Motor copies the context into its executor threads, so the
+# command listener sees the request that issued each command.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '0'))
+MAX_QUERY_SHAPES = 20
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series: Dict[tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: tuple, value: float):
+        with self._lock:
+            series = self.series.setdefault(label_values, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self.series.items()):
+                labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+                prefix = f"{labels}," if labels else ""
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series[-2]}")
+                lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return lines
+
+REQUEST_LATENCY = Histogram(
+    "fitness_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+REQUEST_MONGO_CALLS = Histogram(
+    "fitness_http_request_mongo_calls", "MongoDB round trips per request", ("route",), COUNT_BUCKETS)
+REQUEST_MONGO_SECONDS = Histogram(
+    "fitness_http_request_mongo_seconds", "Time spent in MongoDB per request", ("route",))
+REQUEST_VALIDATION_SECONDS = Histogram(
+    "fitness_http_request_validation_seconds", "Model validation time per request", ("route",))
+REQUEST_SERIALIZATION_SECONDS = Histogram(
+    "fitness_http_request_serialization_seconds", "JSON serialization time per request", ("route",))
+MONGO_COMMAND_SECONDS = Histogram(
+    "fitness_mongo_command_duration_seconds", "MongoDB command latency", ("command", "collection"))
+HISTOGRAMS = [
+    REQUEST_LATENCY, REQUEST_MONGO_CALLS, REQUEST_MONGO_SECONDS,
+    REQUEST_VALIDATION_SECONDS, REQUEST_SERIALIZATION_SECONDS, MONGO_COMMAND_SECONDS,
+]
+
+class RequestMetrics:
+    def __init__(self):
+        self.mongo_calls = 0
+        self.mongo_seconds = 0.0
+        self.validation_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self.query_shapes: List[str] = []
+
+current_request_metrics: contextvars.ContextVar = contextvars.ContextVar("current_request_metrics", default=None)
+
+@contextmanager
+def timed_section(section: str):
+    metrics = current_request_metrics.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            setattr(metrics, f"{section}_seconds", getattr(metrics, f"{section}_seconds") + time.perf_counter() - started)
+
+def query_shape(value):
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [query_shape(value[0])] if value else []
+    return "?"
+
+class MongoCommandListener(monitoring.CommandListener):
+    SHAPE_FIELDS = ("filter", "sort", "pipeline", "updates", "query")
+
+    def __init__(self):
+        self.pending: Dict[int, str] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        collection = collection if isinstance(collection, str) else ""
+        self.pending[event.request_id] = collection
+        metrics = current_request_metrics.get()
+        if metrics is not None and SLOW_REQUEST_MS and len(metrics.query_shapes) < MAX_QUERY_SHAPES:
+            shape = {field: query_shape(event.command[field]) for field in self.SHAPE_FIELDS if field in event.command}
+            metrics.query_shapes.append(f"{event.command_name} {collection} {json.dumps(shape, default=str)}")
+
+    def _finished(self, event):
+        seconds = event.duration_micros / 1e6
+        collection = self.pending.pop(event.request_id, "")
+        MONGO_COMMAND_SECONDS.observe((event.command_name, collection), seconds)
+        metrics = current_request_metrics.get()
+        if metrics is not None:
+            metrics.mongo_calls += 1
+            metrics.mongo_seconds += seconds
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+mongo_command_listener = MongoCommandListener()
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording latency and per-request Mongo/serialization cost by route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        metrics = RequestMetrics()
+        token = current_request_metrics.set(metrics)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request_metrics.reset(token)
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            REQUEST_LATENCY.observe((scope["method"], route_path, str(status)), elapsed)
+            REQUEST_MONGO_CALLS.observe((route_path,), metrics.mongo_calls)
+            REQUEST_MONGO_SECONDS.observe((route_path,), metrics.mongo_seconds)
+            REQUEST_VALIDATION_SECONDS.observe((route_path,), metrics.validation_seconds)
+            REQUEST_SERIALIZATION_SECONDS.observe((route_path,), metrics.serialization_seconds)
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                logging.warning(
+                    f"Slow request {scope['method']} {route_path} took {elapsed * 1000:.1f}ms "
+                    f"({metrics.mongo_calls} Mongo calls, {metrics.mongo_seconds * 1000:.1f}ms): "
+                    + "; ".join(metrics.query_shapes)
+                )
+
+# Response compression
+# Bodies of at least COMPRESSION_MIN_BYTES are compressed with the first
+# encoding in COMPRESSION (server preference order) that the client accepts.
+# Brotli is used when the brotli package is installed. Streaming responses are
+# compressed chunk by chunk; bodies that are already encoded (gzip exports,
+# Content-Encoding set) pass through untouched. A strong ETag gets the
+# encoding appended ("v1" -> "v1-gzip"), since each content-coding is a
+# different representation; etag_matches accepts either form, so validators
+# stay version stamps.
+COMPRESSION = [e.strip() for e in os.environ.get('COMPRESSION', 'br,gzip').split(',') if e.strip()]
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '4'))
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+    COMPRESSION = [e for e in COMPRESSION if e != "br"]
+
+class GzipCompressor:
+    def __init__(self):
+        self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes):
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush()
+
+class BrotliCompressor:
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes):
+        return self.compressor.process(data)
+
+    def finish(self):
+        return self.compressor.finish()
+
+COMPRESSORS = {"gzip": GzipCompressor, "br": BrotliCompressor}
+
+def negotiate_encoding(accept_encoding: str):
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in COMPRESSION:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+def encoded_etag(etag: str, encoding: str):
+    if etag.startswith("W/"):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+class CompressionMiddleware:
+    """Pure ASGI middleware compressing response bodies above a size threshold."""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        encoding = None
+        if scope["type"] == "http" and COMPRESSION:
+            encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        if_none_match = Headers(scope=scope).get("if-none-match", "")
+
+        start = None
+        buffered = bytearray()
+        compressor = None
+        passthrough = False
+
+        def compressible(headers: Headers):
+            content_type = headers.get("content-type", "")
+            return (
+                start["status"] not in (204, 304)
+                and "content-encoding" not in headers
+                and content_type.startswith(COMPRESSIBLE_TYPES)
+            )
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start["headers"])
+                if not compressible(headers):
+                    # A 304 carries the validator the client holds, which may be the encoded one
+                    if start["status"] == 304 and "etag" in headers:
+                        etag = encoded_etag(headers["etag"], encoding)
+                        if etag in if_none_match:
+                            headers["ETag"] = etag
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                buffered.extend(body)
+                if len(buffered) < self.minimum_size:
+                    if more_body:
+                        return
+                    passthrough = True
+                    await send(start)
+                    await send({"type": "http.response.body", "body": bytes(buffered)})
+                    return
+                compressor = COMPRESSORS[encoding]()
+                body = bytes(buffered)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "etag" in headers:
+                    headers["ETag"] = encoded_etag(headers["etag"], encoding)
+                del headers["Content-Length"]
+                if not more_body:
+                    compressed = compressor.compress(body) + compressor.finish()
+                    headers["Content-Length"] = str(len(compressed))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                await send(start)
+
+            compressed = compressor.compress(body)
+            if not more_body:
+                compressed += compressor.finish()
+            if compressed or not more_body:
+                await send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
 # MongoDB connection
+# The client is created by the startup hook, i.e. in each worker process after
+# uvicorn/gunicorn has forked, never at import time, so no connection pool is
+# ever shared across a fork. Run several workers with e.g.
+#   uvicorn server:app --workers 4
+# and size MONGO_MAX_POOL_SIZE per worker (workers x pool size connections in
+# total). Caches (catalog, data versions, trends) and the write-behind buffer
+# are per worker; catalog and data version stamps live in Mongo so workers
+# converge within their TTLs.
+# Stats and list routes read through read_db, which uses
+# MONGO_READ_PREFERENCE (e.g. secondaryPreferred) when set; users who wrote
+# within SECONDARY_READ_GRACE_SECONDS read from the primary instead so they
+# always see their own writes.
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+DB_NAME = os.environ['DB_NAME']
+MONGO_POOL_SETTINGS = {
+    "maxPoolSize": "MONGO_MAX_POOL_SIZE",
+    "minPoolSize": "MONGO_MIN_POOL_SIZE",
+    "maxIdleTimeMS": "MONGO_MAX_IDLE_TIME_MS",
+    "waitQueueTimeoutMS": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+    "connectTimeoutMS": "MONGO_CONNECT_TIMEOUT_MS",
+    "socketTimeoutMS": "MONGO_SOCKET_TIMEOUT_MS",
+    "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+}
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+MONGO_MAX_STALENESS = int(os.environ.get('MONGO_MAX_STALENESS_SECONDS', '-1'))
+SECONDARY_READ_GRACE = float(os.environ.get('SECONDARY_READ_GRACE_SECONDS', '90'))
+
+if MONGO_READ_PREFERENCE not in READ_PREFERENCES:
+    raise RuntimeError(f"MONGO_READ_PREFERENCE must be one of {', '.join(READ_PREFERENCES)}")
+
+client: Optional[AsyncIOMotorClient] = None
+db = None
+read_db = None
+
+def mongo_client_options():
+    options = {
+        "tz_aware": True,
+        "event_listeners": [mongo_command_listener],
+        "appname": os.environ.get('MONGO_APP_NAME', 'fitness-backend'),
+    }
+    for option, variable in MONGO_POOL_SETTINGS.items():
+        if os.environ.get(variable):
+            options[option] = int(os.environ[variable])
+    return options
+
+def stats_read_preference():
+    if MONGO_READ_PREFERENCE == "primary":
+        return Primary()
+    return READ_PREFERENCES[MONGO_READ_PREFERENCE](max_staleness=MONGO_MAX_STALENESS)
+
+def connect_mongo():
+    """Create the client and database handles for this process."""
+    global client, db, read_db
+    client = AsyncIOMotorClient(mongo_url, **mongo_client_options())
+    db = client[DB_NAME]
+    read_db = client.get_database(DB_NAME, read_preference=stats_read_preference())
+    return db
+
+def close_mongo():
+    global client, db, read_db
+    if client is not None:
+        client.close()
+    client = db = read_db = None
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -40,6 +439,7 @@ class ExerciseLevel(str, Enum):
 # Models
 class Exercise(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    slug: Optional[str] = None  # stable key in exercise_catalog.json
     name: str
     description: str
     video_url: str
@@ -53,6 +453,17 @@ class Exercise(BaseModel):
     equipment: List[str] = []
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ExerciseSummary(BaseModel):
+    # List view: everything a catalog card needs, without the long text fields
+    id: str
+    name: str
+    video_url: str
+    exercise_type: ExerciseType
+    level: ExerciseLevel
+    default_duration: int  # seconds
+    default_repetitions: Optional[int] = None
+    muscle_groups: List[str]
+
 class WorkoutSession(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     date: str  # ISO date string
@@ -63,6 +474,19 @@ class WorkoutSession(BaseModel):
     notes: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class WorkoutStats(BaseModel):
+    total_sessions: int
+    recent_sessions: int
+    total_workout_time: int
+    average_session_time: int
+
+class WorkoutSessionWithStats(WorkoutSession):
+    stats: WorkoutStats
+
+class Dashboard(BaseModel):
+    exercises: List[Exercise]
+    stats: WorkoutStats
+
 class UserProfile(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     height: Optional[float] = None  # cm
@@ -76,6 +500,32 @@ class UserProfile(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class PlanRequest(BaseModel):
+    # Anything left out falls back to the user's profile
+    duration: Optional[int] = Field(None, ge=1)  # minutes
+    fitness_level: Optional[ExerciseLevel] = None
+    available_equipment: Optional[List[str]] = None
+    goals: Optional[List[str]] = None
+    exercise_types: Optional[List[ExerciseType]] = None
+
+class PlanItem(BaseModel):
+    exercise_id: str
+    name: str
+    exercise_type: ExerciseType
+    sets: int
+    work_seconds: int
+    rest_seconds: int
+    repetitions: Optional[int] = None
+    duration: int  # seconds
+
+class WorkoutPlan(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    fitness_level: ExerciseLevel
+    duration_budget: int  # seconds
+    total_duration: int  # seconds
+    items: List[PlanItem]
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
 class AbdominalMeasurement(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     measurement: float  # cm
@@ -83,123 +533,2477 @@ class AbdominalMeasurement(BaseModel):
     notes: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ExerciseStats(BaseModel):
+    exercise_id: str
+    count: int = 0
+    total_seconds: int = 0
+    total_repetitions: int = 0
+    best_seconds: int = 0
+    best_repetitions: int = 0
+    last_performed: Optional[datetime] = None
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    member: str  # pseudonymous user id, or exercise id
+    score: int
+    name: Optional[str] = None  # exercise name
+
+class Leaderboard(BaseModel):
+    kind: str
+    period: Optional[str] = None  # first day of the week for weekly boards
+    entries: List[LeaderboardEntry]
+    me: Optional[LeaderboardEntry] = None
+
+class BulkItemResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    status: str  # created, duplicate, conflict or invalid
+    error: Optional[str] = None
+
+class BulkResult(BaseModel):
+    created: int
+    duplicates: int
+    conflicts: int = 0
+    invalid: int
+    results: List[BulkItemResult]
+
 # Helper function to prepare data for MongoDB
+# Models reaching a write were validated once on the way in (request bodies by
+# FastAPI, bulk items by ingest_bulk), so they are stored as dumped and the
+# read fast path can serve stored documents as-is. Datetimes are stored as
+# native BSON dates.
 def prepare_for_mongo(data):
-    if isinstance(data, dict):
-        prepared = {}
-        for key, value in data.items():
-            if isinstance(value, datetime):
-                prepared[key] = value.isoformat()
-            elif isinstance(value, list):
-                prepared[key] = [prepare_for_mongo(item) if isinstance(item, dict) else item for item in value]
-            elif isinstance(value, dict):
-                prepared[key] = prepare_for_mongo(value)
-            else:
-                prepared[key] = value
-        return prepared
+    if isinstance(data, BaseModel):
+        return data.dict()
     return data
 
-# Initialize default exercises
-async def initialize_exercises():
-    existing_count = await db.exercises.count_documents({})
-    if existing_count == 0:
-        default_exercises = [
-            {
-                "name": "Push-up",
-                "description": "Ejercicio clásico para fortalecer pectorales, tríceps y core",
-                "video_url": "https://www.youtube.com/watch?v=IODxDxX7oi4",
-                "exercise_type": "pectoral",
-                "level": "beginner",
-                "default_duration": 30,
-                "default_rest": 30,
-                "default_repetitions": 10,
-                "instructions": [
-                    "Colócate en posición de plancha con las manos separadas al ancho de los hombros",
-                    "Mantén el cuerpo recto desde la cabeza hasta los talones",
-                    "Baja el pecho hacia el suelo doblando los codos",
-                    "Empuja hacia arriba hasta la posición inicial"
-                ],
-                "muscle_groups": ["Pectorales", "Tríceps", "Core"],
-                "equipment": ["Colchoneta"]
-            },
-            {
-                "name": "Russian Twist",
-                "description": "Ejercicio rotacional para fortalecer oblicuos y core",
-                "video_url": "https://www.youtube.com/watch?v=wkD8rjkodUI",
-                "exercise_type": "abdominal",
-                "level": "intermediate",
-                "default_duration": 45,
-                "default_rest": 25,
-                "default_repetitions": 20,
-                "instructions": [
-                    "Siéntate en el suelo con las rodillas dobladas",
-                    "Inclínate ligeramente hacia atrás manteniendo la espalda recta",
-                    "Levanta los pies del suelo (opcional para mayor dificultad)",
-                    "Rota el torso de lado a lado tocando el suelo con las manos"
-                ],
-                "muscle_groups": ["Oblicuos", "Core", "Abdominales"],
-                "equipment": ["Colchoneta"]
-            },
-            {
-                "name": "Mountain Climber",
-                "description": "Ejercicio cardiovascular que fortalece core y mejora resistencia",
-                "video_url": "https://www.youtube.com/watch?v=nmwgirgXLYM",
-                "exercise_type": "cardio",
-                "level": "intermediate",
-                "default_duration": 40,
-                "default_rest": 30,
-                "instructions": [
-                    "Comienza en posición de plancha con brazos extendidos",
-                    "Lleva una rodilla hacia el pecho rápidamente",
-                    "Regresa la pierna a la posición inicial",
-                    "Alterna las piernas de forma rápida y continua"
-                ],
-                "muscle_groups": ["Core", "Hombros", "Piernas"],
-                "equipment": ["Colchoneta"]
-            },
+# Stored documents use the model's uuid as _id instead of carrying both an
+# ObjectId and an id field; reads rename it back.
+def to_document(model: BaseModel, user_id: Optional[str] = None):
+    data = prepare_for_mongo(model)
+    document = {"_id": data.pop("id"), **data}
+    if user_id is not None:
+        document["user_id"] = user_id
+    return document
+
+def from_document(document):
+    return {"id": document.pop("_id"), **document}
+
+def model_projection(model):
+    """Inclusion projection for a response model; _id (the model id) is returned by default."""
+    return {field: 1 for field in model.model_fields if field != "id"}
+
+def as_utc(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+# Response fast path
+# By default list and detail routes encode trusted Mongo documents straight to
+# JSON bytes. STRICT_RESPONSES=1 restores per-document pydantic validation
+# through response_model, e.g. to compare outputs in tests.
+STRICT_RESPONSES = os.environ.get('STRICT_RESPONSES', '').lower() in ('1', 'true', 'yes')
+
+try:
+    import orjson
+
+    def dumps_json(content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+except ImportError:
+    def json_default(value):
+        if isinstance(value, datetime):
+            # UTC as "Z", the way pydantic writes it in strict mode
+            encoded = value.isoformat()
+            return encoded[:-6] + "Z" if value.utcoffset() == timedelta(0) else encoded
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    def dumps_json(content) -> bytes:
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=json_default).encode("utf-8")
+
+def json_response(content, response: Optional[Response] = None, encoded: Optional[bytes] = None):
+    if encoded is None:
+        with timed_section("serialization"):
+            encoded = dumps_json(content)
+    fast = Response(content=encoded, media_type="application/json")
+    if response is not None:
+        fast.raw_headers.extend(response.raw_headers)
+    return fast
+
+# Request user
+# Profiles, sessions and measurements are scoped per user. With JWT_SECRET set
+# the user is the `sub` claim of an HS256 bearer token; otherwise the
+# X-User-Id header is trusted (e.g. behind an authenticating gateway) and
+# requests without it belong to a single default user.
+DEFAULT_USER_ID = "default"
+JWT_SECRET = os.environ.get('JWT_SECRET')
+MAX_USER_ID_LENGTH = 128
+# Stored documents carry user_id; it is never part of a response
+USER_DOC_PROJECTION = {"_id": 0, "user_id": 0}
+SESSION_PROJECTION = model_projection(WorkoutSession)
+MEASUREMENT_PROJECTION = model_projection(AbdominalMeasurement)
+PROFILE_PROJECTION = model_projection(UserProfile)
+
+async def get_user_id(
+    x_user_id: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None),
+):
+    if JWT_SECRET:
+        scheme, _, token = (authorization or "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPException(status_code=401, detail="Missing bearer token")
+        try:
+            user_id = jwt.decode(token, JWT_SECRET, algorithms=["HS256"]).get("sub")
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+    else:
+        user_id = x_user_id or DEFAULT_USER_ID
+    if not isinstance(user_id, str) or not user_id or len(user_id) > MAX_USER_ID_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid user id")
+    return user_id
+
+async def assign_default_user():
+    """Attach documents written before per-user scoping to the default user."""
+    marker = await db.metadata.find_one({"_id": "user_scoping"})
+    if marker:
+        return
+    # Profiles are unique per user, so only the most recently updated legacy
+    # profile can become the default user's; the others are dropped
+    legacy_profiles = await db.user_profiles.find(
+        {"user_id": {"$in": [None, DEFAULT_USER_ID]}}, {"_id": 1}
+    ).sort("updated_at", DESCENDING).to_list(length=None)
+    if len(legacy_profiles) > 1:
+        stale = [profile["_id"] for profile in legacy_profiles[1:]]
+        await db.user_profiles.delete_many({"_id": {"$in": stale}})
+        logging.info(f"Dropped {len(stale)} older legacy profiles in favour of {legacy_profiles[0]['_id']}")
+    for collection in (db.workout_sessions, db.measurements, db.user_profiles):
+        result = await collection.update_many(
+            {"user_id": {"$exists": False}}, {"$set": {"user_id": DEFAULT_USER_ID}}
+        )
+        if result.modified_count:
+            logging.info(f"Assigned {result.modified_count} {collection.name} documents to the default user")
+    await db.metadata.update_one({"_id": "user_scoping"}, {"$set": {"applied_at": datetime.now(timezone.utc)}}, upsert=True)
+
+# Workout stats rollup
+# One materialized document per user, kept up to date by
+# create_workout_session, so /workouts/stats is a single point read instead
+# of a scan over workout_sessions.
+# Daily buckets only cover the window: sessions dated before it add none, and
+# buckets that have aged out of it are unset on the next write.
+STATS_WINDOW_DAYS = 30
+
+def stats_day(created_at):
+    return as_utc(created_at).date().isoformat()
+
+def stats_window_start():
+    return (datetime.now(timezone.utc) - timedelta(days=STATS_WINDOW_DAYS)).date().isoformat()
+
+async def record_workout_stats(user_id: str, workouts: List[WorkoutSession]):
+    """Apply the sessions to the user's rollup and return the updated rollup."""
+    if not workouts:
+        return await db.workout_stats.find_one({"_id": user_id})
+    window_start = stats_window_start()
+    increments: Dict[str, int] = {"total_sessions": 0, "total_duration": 0}
+    for workout in workouts:
+        day = stats_day(workout.created_at)
+        increments["total_sessions"] += 1
+        increments["total_duration"] += workout.total_duration
+        if day >= window_start:
+            increments[f"daily.{day}.sessions"] = increments.get(f"daily.{day}.sessions", 0) + 1
+            increments[f"daily.{day}.duration"] = increments.get(f"daily.{day}.duration", 0) + workout.total_duration
+    rollup = await db.workout_stats.find_one_and_update(
+        {"_id": user_id},
+        {"$inc": increments, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    stale = [day for day in rollup.get("daily", {}) if day < window_start]
+    if stale:
+        await db.workout_stats.update_one({"_id": user_id}, {"$unset": {f"daily.{day}": "" for day in stale}})
+        for day in stale:
+            del rollup["daily"][day]
+    return rollup
+
+async def rebuild_workout_stats():
+    """Recompute every user's stats rollup from the raw workout sessions."""
+    window_start = stats_window_start()
+    rollups: Dict[str, Dict[str, Any]] = {}
+    active_days: Dict[str, set] = {}
+    cursor = db.workout_sessions.find({}, {"_id": 0, "user_id": 1, "created_at": 1, "total_duration": 1})
+    async for session in cursor:
+        user_id = session.get("user_id", DEFAULT_USER_ID)
+        rollup = rollups.setdefault(user_id, {
+            "_id": user_id, "total_sessions": 0, "total_duration": 0, "daily": {},
+        })
+        duration = session.get("total_duration") or 0
+        rollup["total_sessions"] += 1
+        rollup["total_duration"] += duration
+        day = stats_day(session["created_at"])
+        active_days.setdefault(user_id, set()).add(day)
+        if day >= window_start:
+            bucket = rollup["daily"].setdefault(day, {"sessions": 0, "duration": 0})
+            bucket["sessions"] += 1
+            bucket["duration"] += duration
+
+    for user_id, days in active_days.items():
+        rollups[user_id]["streak_start"], rollups[user_id]["streak_end"] = latest_streak(days)
+
+    # Replace in place rather than clear and reinsert, so a session recorded
+    # while the rebuild runs cannot make the rewrite stop part way
+    updated_at = datetime.now(timezone.utc)
+    if rollups:
+        await db.workout_stats.bulk_write([
+            ReplaceOne({"_id": user_id}, {**rollup, "updated_at": updated_at}, upsert=True)
+            for user_id, rollup in rollups.items()
+        ], ordered=False)
+    await db.workout_stats.delete_many({"_id": {"$nin": list(rollups)}})
+    await data_versions.bump_all()
+    total_sessions = sum(rollup["total_sessions"] for rollup in rollups.values())
+    logging.info(f"Rebuilt workout stats rollups for {len(rollups)} users from {total_sessions} sessions")
+    return rollups
+
+async def verify_workout_stats():
+    """Compare each user's rollup against a live aggregate; returns the mismatches by user."""
+    rollups = {
+        rollup["_id"]: rollup
+        for rollup in await db.workout_stats.find({}, {"daily": 0}).to_list(length=None)
+    }
+    pipeline = [
+        {"$group": {"_id": "$user_id", "sessions": {"$sum": 1}, "total_time": {"$sum": "$total_duration"}}}
+    ]
+    live = {
+        row["_id"]: row
+        for row in await db.workout_sessions.aggregate(pipeline).to_list(length=None)
+    }
+
+    mismatches = {}
+    for user_id in set(rollups) | set(live):
+        rollup = rollups.get(user_id, {})
+        row = live.get(user_id, {})
+        user_mismatches = {}
+        if rollup.get("total_sessions", 0) != row.get("sessions", 0):
+            user_mismatches["total_sessions"] = {"rollup": rollup.get("total_sessions", 0), "live": row.get("sessions", 0)}
+        if rollup.get("total_duration", 0) != row.get("total_time", 0):
+            user_mismatches["total_duration"] = {"rollup": rollup.get("total_duration", 0), "live": row.get("total_time", 0)}
+        if user_mismatches:
+            mismatches[user_id] = user_mismatches
+    return mismatches
+
+async def ensure_workout_stats():
+    if await db.workout_stats.find_one({}, {"_id": 1}):
+        return
+    if await db.workout_sessions.find_one({}, {"_id": 1}):
+        await rebuild_workout_stats()
+
+def summarize_workout_stats(rollup, pending: Optional[List[WorkoutSession]] = None):
+    """Summarize a rollup, counting sessions that are accepted but not yet flushed in pending."""
+    rollup = rollup or {}
+    total_sessions = rollup.get("total_sessions", 0)
+    total_time = rollup.get("total_duration", 0)
+    window_start = stats_window_start()
+    recent_sessions = sum(
+        bucket.get("sessions", 0)
+        for day, bucket in rollup.get("daily", {}).items()
+        if day >= window_start
+    )
+    for workout in pending or []:
+        total_sessions += 1
+        total_time += workout.total_duration
+        if stats_day(workout.created_at) >= window_start:
+            recent_sessions += 1
+    return {
+        "total_sessions": total_sessions,
+        "recent_sessions": recent_sessions,
+        "total_workout_time": total_time,
+        "average_session_time": total_time // total_sessions if total_sessions > 0 else 0
+    }
+
+# Streaks
+# Each rollup also records the user's latest run of consecutive active days as
+# streak_start/streak_end (ISO days). Writes extend it with a compare-and-set
+# on the previous run, so concurrent workers never lose an update; a session
+# backdated to before the run start - 1 is only picked up by a rebuild.
+STREAK_UPDATE_ATTEMPTS = 3
+
+def extend_streak(start: Optional[str], end: Optional[str], day: str):
+    if start is None or end is None:
+        return day, day
+    day_number = date.fromisoformat(day).toordinal()
+    start_number = date.fromisoformat(start).toordinal()
+    end_number = date.fromisoformat(end).toordinal()
+    if start_number <= day_number <= end_number or day_number < start_number - 1:
+        return start, end
+    if day_number == start_number - 1:
+        return day, end
+    if day_number == end_number + 1:
+        return start, day
+    return day, day
+
+def latest_streak(days):
+    ordered = sorted(date.fromisoformat(day).toordinal() for day in days)
+    start = ordered[-1]
+    for day_number in reversed(ordered[:-1]):
+        if day_number != start - 1:
+            break
+        start = day_number
+    return date.fromordinal(start).isoformat(), date.fromordinal(ordered[-1]).isoformat()
+
+def active_streak(rollup, today: date):
+    """Length of the user's current streak: 0 unless the last active day was today or yesterday."""
+    start, end = rollup.get("streak_start"), rollup.get("streak_end")
+    if not start or not end or (today - date.fromisoformat(end)).days > 1:
+        return 0
+    return (date.fromisoformat(end) - date.fromisoformat(start)).days + 1
+
+async def record_streak(user_id: str, rollup, workouts: List[WorkoutSession]):
+    """Extend the rollup's streak with the sessions' days; returns the updated rollup."""
+    days = sorted({stats_day(workout.created_at) for workout in workouts})
+    for _ in range(STREAK_UPDATE_ATTEMPTS):
+        start, end = rollup.get("streak_start"), rollup.get("streak_end")
+        new_start, new_end = start, end
+        for day in days:
+            new_start, new_end = extend_streak(new_start, new_end, day)
+        if (new_start, new_end) == (start, end):
+            return rollup
+        updated = await db.workout_stats.find_one_and_update(
+            {"_id": user_id, "streak_start": start, "streak_end": end},
+            {"$set": {"streak_start": new_start, "streak_end": new_end}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if updated:
+            return updated
+        rollup = await db.workout_stats.find_one({"_id": user_id}) or {}
+    logging.warning(f"Gave up updating the streak of user {user_id} after concurrent writes")
+    return rollup
+
+# Keyset pagination over (created_at, _id), newest first
+MAX_PAGE_SIZE = 200
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(doc):
+    raw = json.dumps([as_utc(doc["created_at"]).isoformat(), doc["_id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(created_at, str) or not isinstance(doc_id, str):
+            raise ValueError
+        return as_utc(created_at), doc_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def created_at_range(from_date: Optional[datetime] = None, to_date: Optional[datetime] = None):
+    created_range = {}
+    if from_date:
+        created_range["$gte"] = as_utc(from_date)
+    if to_date:
+        created_range["$lt"] = as_utc(to_date)
+    return created_range
+
+async def fetch_page(collection, response: Response, user_id: str, limit: int, projection: Dict[str, int],
+                     cursor: Optional[str] = None, from_date: Optional[datetime] = None,
+                     to_date: Optional[datetime] = None):
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    created_range = created_at_range(from_date, to_date)
+
+    clauses = [{"user_id": user_id}]
+    if created_range:
+        clauses.append({"created_at": created_range})
+    if cursor:
+        created_at, doc_id = decode_cursor(cursor)
+        clauses.append({"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": doc_id}},
+        ]})
+    filter_query = {"$and": clauses} if len(clauses) > 1 else clauses[0]
+
+    docs = await collection.find(filter_query, projection).sort(
+        [("created_at", -1), ("_id", -1)]
+    ).limit(limit + 1).to_list(length=None)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(docs[-1])
+    return [from_document(doc) for doc in docs]
+
+# Index registry: every index the routes rely on, per collection
+INDEXES = {
+    "exercises": [
+        IndexModel([("exercise_type", ASCENDING), ("level", ASCENDING)]),
+        IndexModel([("level", ASCENDING)]),
+        IndexModel([("seq", ASCENDING)]),
+        IndexModel([("slug", ASCENDING)], unique=True, sparse=True),
+    ],
+    "workout_sessions": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("seq", ASCENDING)]),
+    ],
+    "measurements": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("seq", ASCENDING)]),
+    ],
+    "user_profiles": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+    "exercise_stats": [
+        IndexModel([("user_id", ASCENDING), ("exercise_id", ASCENDING)], unique=True),
+    ],
+    "workout_plans": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+}
+
+# Representative query shapes issued by the routes, checked by verify_query_plans
+QUERY_SHAPES = [
+    ("get_exercise", "exercises", {"_id": "x"}, None),
+    ("apply_exercise_catalog", "exercises", {"slug": {"$in": ["x"]}}, None),
+    ("get_exercises?exercise_type", "exercises", {"exercise_type": "abdominal"}, None),
+    ("get_exercises?level", "exercises", {"level": "beginner"}, None),
+    ("get_exercises?exercise_type&level", "exercises", {"exercise_type": "abdominal", "level": "beginner"}, None),
+    ("get_workout_sessions", "workout_sessions", {"user_id": "u"}, [("created_at", -1), ("_id", -1)]),
+    ("get_workout_sessions?cursor", "workout_sessions",
+     {"$and": [{"user_id": "u"}, {"$or": [{"created_at": {"$lt": "x"}}, {"created_at": "x", "_id": {"$lt": "x"}}]}]},
+     [("created_at", -1), ("_id", -1)]),
+    ("get_workout_sessions?from&to", "workout_sessions",
+     {"user_id": "u", "created_at": {"$gte": "x", "$lt": "y"}}, [("created_at", -1), ("_id", -1)]),
+    ("get_measurements", "measurements", {"user_id": "u"}, [("created_at", -1), ("_id", -1)]),
+    ("get_measurements?from&to", "measurements",
+     {"user_id": "u", "created_at": {"$gte": "x", "$lt": "y"}}, [("created_at", -1), ("_id", -1)]),
+    ("export_workout_sessions", "workout_sessions",
+     {"user_id": "u", "created_at": {"$gte": "x"}}, [("created_at", 1), ("_id", 1)]),
+    ("export_measurements", "measurements",
+     {"user_id": "u", "created_at": {"$gte": "x"}}, [("created_at", 1), ("_id", 1)]),
+    ("get_trends", "workout_sessions", {"user_id": "u", "created_at": {"$gte": "x"}}, None),
+    ("get_profile", "user_profiles", {"user_id": "u"}, None),
+    ("get_exercise_stats", "exercise_stats", {"user_id": "u", "exercise_id": "x"}, None),
+    ("generate_workout_plan", "exercise_stats", {"user_id": "u"}, None),
+    ("get_current_plan", "workout_plans", {"user_id": "u"}, None),
+    ("sync_changes:exercises", "exercises", {"seq": {"$gt": 0}}, [("seq", 1)]),
+    ("sync_changes:workouts", "workout_sessions", {"user_id": "u", "seq": {"$gt": 0}}, [("seq", 1)]),
+    ("sync_changes:measurements", "measurements", {"user_id": "u", "seq": {"$gt": 0}}, [("seq", 1)]),
+    ("sync_changes:profile", "user_profiles", {"user_id": "u", "seq": {"$gt": 0}}, [("seq", 1)]),
+]
+
+async def ensure_indexes():
+    for collection_name, indexes in INDEXES.items():
+        await db[collection_name].create_indexes(indexes)
+
+def plan_stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from plan_stages(item)
+
+async def verify_query_plans():
+    """Explain every route query shape and raise if any of them falls back to a COLLSCAN."""
+    collscans = []
+    for name, collection_name, filter_query, sort in QUERY_SHAPES:
+        cursor = db[collection_name].find(filter_query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explained = await cursor.explain()
+        winning_plan = explained.get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in plan_stages(winning_plan):
+            collscans.append(name)
+    if collscans:
+        raise RuntimeError(f"Query shapes resolved to COLLSCAN: {', '.join(collscans)}")
+    logging.info(f"Verified query plans for {len(QUERY_SHAPES)} route query shapes")
+
+# Compact document migration
+# Documents written before the compact layout carry an ObjectId _id next to a
+# uuid id field and store dates as ISO strings. They are re-inserted keyed by
+# their uuid with native dates (deleting the original), in batches, so an
+# interrupted run can simply be started again. Derived views are rebuilt
+# afterwards since their dates were strings too.
+COMPACT_DOCUMENTS_ID = "compact_documents"
+COMPACT_DATE_FIELDS = {
+    "exercises": ("created_at",),
+    "workout_sessions": ("created_at",),
+    "measurements": ("created_at",),
+    "user_profiles": ("created_at", "updated_at"),
+}
+MIGRATION_BATCH_SIZE = 1000
+
+def compact_document(document, date_fields):
+    compact = {"_id": document["id"]}
+    for key, value in document.items():
+        if key in ("_id", "id"):
+            continue
+        compact[key] = as_utc(value) if key in date_fields and isinstance(value, str) else value
+    return compact
+
+INDEX_NOT_FOUND_ERROR = 27
+
+async def drop_index_if_present(collection, name: str):
+    try:
+        await collection.drop_index(name)
+    except OperationFailure as e:
+        # Already dropped by an earlier, interrupted run
+        if e.code != INDEX_NOT_FOUND_ERROR:
+            raise
+
+async def drop_legacy_id_indexes(collection):
+    for name, info in (await collection.index_information()).items():
+        if any(field == "id" for field, _ in info["key"]):
+            await drop_index_if_present(collection, name)
+
+async def drop_unique_indexes(collection):
+    """Drop unique secondary indexes, which a legacy document and its compact copy would both violate."""
+    dropped = []
+    for name, info in (await collection.index_information()).items():
+        if name != "_id_" and info.get("unique"):
+            await drop_index_if_present(collection, name)
+            dropped.append(IndexModel(info["key"], name=name, unique=True, sparse=info.get("sparse", False)))
+    return dropped
+
+async def rekey_collection(collection, date_fields):
+    migrated = 0
+    while True:
+        batch = await collection.find({"id": {"$exists": True}}).limit(MIGRATION_BATCH_SIZE).to_list(length=None)
+        if not batch:
+            return migrated
+        try:
+            await collection.insert_many([compact_document(doc, date_fields) for doc in batch], ordered=False)
+        except BulkWriteError as e:
+            # Already copied by an earlier, interrupted run
+            if any(error.get("code") != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+                raise
+        # Only delete originals whose compact copy is confirmed to exist
+        copied = {
+            doc["_id"]
+            async for doc in collection.find({"_id": {"$in": [doc["id"] for doc in batch]}}, {"_id": 1})
+        }
+        originals = [doc["_id"] for doc in batch if doc["id"] in copied]
+        if originals:
+            await collection.delete_many({"_id": {"$in": originals}})
+        migrated += len(originals)
+        if len(originals) < len(batch):
+            raise RuntimeError(
+                f"Could not copy {len(batch) - len(originals)} {collection.name} documents to the compact layout"
+            )
+
+async def migrate_compact_documents():
+    marker = await db.metadata.find_one({"_id": COMPACT_DOCUMENTS_ID})
+    if marker:
+        return 0
+    migrated = 0
+    for collection_name, date_fields in COMPACT_DATE_FIELDS.items():
+        collection = db[collection_name]
+        await drop_legacy_id_indexes(collection)
+        unique_indexes = await drop_unique_indexes(collection)
+        count = await rekey_collection(collection, date_fields)
+        if unique_indexes:
+            await collection.create_indexes(unique_indexes)
+        if count:
+            logging.info(f"Migrated {count} {collection_name} documents to the compact layout")
+        migrated += count
+    plans = await db.workout_plans.find(
+        {"created_at": {"$type": "string"}}, {"created_at": 1}
+    ).to_list(length=None)
+    if plans:
+        await db.workout_plans.bulk_write([
+            UpdateOne({"_id": plan["_id"]}, {"$set": {"created_at": as_utc(plan["created_at"])}})
+            for plan in plans
+        ], ordered=False)
+    if migrated:
+        await rebuild_workout_stats()
+        await rebuild_exercise_stats()
+        await bump_catalog_version()
+    await db.metadata.update_one(
+        {"_id": COMPACT_DOCUMENTS_ID}, {"$set": {"applied_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+    return migrated
+
+# Per-exercise stats
+# exercises_completed entries are free-form; the web client sends
+# total_duration and sets_completed, other clients send per-set duration,
+# repetitions and sets. They are normalized into exercise_stats documents
+# keyed by (user_id, exercise_id) and updated with one bulk_write per session
+# batch.
+def as_number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+def normalize_completed_exercise(entry: Dict[str, Any]):
+    sets = as_number(entry.get("sets")) or as_number(entry.get("sets_completed")) or 1
+    seconds = as_number(entry.get("total_duration")) or as_number(entry.get("duration")) * sets
+    repetitions = as_number(entry.get("repetitions")) * sets
+    return int(seconds), int(repetitions)
+
+def accumulate_exercise_stats(totals: Dict[str, Dict[str, Any]], entries, created_at: datetime):
+    for entry in entries or []:
+        exercise_id = entry.get("exercise_id") if isinstance(entry, dict) else None
+        if not isinstance(exercise_id, str):
+            continue
+        seconds, repetitions = normalize_completed_exercise(entry)
+        stats = totals.setdefault(exercise_id, {
+            "count": 0, "total_seconds": 0, "total_repetitions": 0,
+            "best_seconds": 0, "best_repetitions": 0, "last_performed": created_at,
+        })
+        stats["count"] += 1
+        stats["total_seconds"] += seconds
+        stats["total_repetitions"] += repetitions
+        stats["best_seconds"] = max(stats["best_seconds"], seconds)
+        stats["best_repetitions"] = max(stats["best_repetitions"], repetitions)
+        stats["last_performed"] = max(stats["last_performed"], created_at)
+    return totals
+
+async def record_exercise_stats(user_id: str, workouts: List[WorkoutSession]):
+    totals: Dict[str, Dict[str, Any]] = {}
+    for workout in workouts:
+        accumulate_exercise_stats(totals, workout.exercises_completed, as_utc(workout.created_at))
+    if not totals:
+        return
+    await db.exercise_stats.bulk_write([
+        UpdateOne(
+            {"user_id": user_id, "exercise_id": exercise_id},
             {
-                "name": "Elevación de piernas y crunch abdominal",
-                "description": "Combinación de ejercicios para abdomen bajo y alto",
-                "video_url": "https://www.youtube.com/watch?v=JB2oyawG9KI",
-                "exercise_type": "abdominal",
-                "level": "beginner",
-                "default_duration": 35,
-                "default_rest": 25,
-                "default_repetitions": 15,
-                "instructions": [
-                    "Acuéstate boca arriba con las manos detrás de la cabeza",
-                    "Eleva las piernas rectas hacia arriba",
-                    "Realiza un crunch llevando el torso hacia las piernas",
-                    "Baja controladamente a la posición inicial"
-                ],
-                "muscle_groups": ["Abdomen alto", "Abdomen bajo", "Core"],
-                "equipment": ["Colchoneta"]
+                "$inc": {key: stats[key] for key in ("count", "total_seconds", "total_repetitions")},
+                "$max": {key: stats[key] for key in ("best_seconds", "best_repetitions", "last_performed")},
             },
-            {
-                "name": "Peso muerto con mancuernas",
-                "description": "Ejercicio compound para fortalecer espalda baja, glúteos y piernas",
-                "video_url": "https://www.youtube.com/watch?v=ytGaGIn3SjE",
-                "exercise_type": "full_body",
-                "level": "intermediate",
-                "default_duration": 45,
-                "default_rest": 40,
-                "default_repetitions": 12,
-                "instructions": [
-                    "Mantente de pie con pies separados al ancho de caderas",
-                    "Sostén las mancuernas frente a los muslos",
-                    "Inclínate hacia adelante desde las caderas manteniendo espalda recta",
-                    "Regresa a la posición inicial activando glúteos y isquiotibiales"
-                ],
-                "muscle_groups": ["Espalda baja", "Glúteos", "Isquiotibiales", "Core"],
-                "equipment": ["Mancuernas"]
-            }
-        ]
-        
-        for exercise_data in default_exercises:
-            exercise = Exercise(**exercise_data)
-            await db.exercises.insert_one(prepare_for_mongo(exercise.dict()))
-        
-        logging.info(f"Initialized {len(default_exercises)} default exercises")
+            upsert=True,
+        )
+        for exercise_id, stats in totals.items()
+    ], ordered=False)
+
+async def rebuild_exercise_stats():
+    """Recompute exercise_stats from every stored workout session."""
+    totals_by_user: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    cursor = db.workout_sessions.find(
+        {}, {"_id": 0, "user_id": 1, "exercises_completed": 1, "created_at": 1}
+    ).batch_size(EXPORT_BATCH_SIZE)
+    async for session in cursor:
+        totals = totals_by_user.setdefault(session.get("user_id", DEFAULT_USER_ID), {})
+        accumulate_exercise_stats(totals, session.get("exercises_completed"), as_utc(session["created_at"]))
+    # Replace each (user_id, exercise_id) document in place and then remove
+    # only the ones not rebuilt, so concurrent writes never see an empty
+    # collection or collide with a reinserted document
+    documents = [
+        {"user_id": user_id, "exercise_id": exercise_id, **stats}
+        for user_id, totals in totals_by_user.items()
+        for exercise_id, stats in totals.items()
+    ]
+    if documents:
+        await db.exercise_stats.bulk_write([
+            ReplaceOne({"user_id": doc["user_id"], "exercise_id": doc["exercise_id"]}, doc, upsert=True)
+            for doc in documents
+        ], ordered=False)
+    for user_id, totals in totals_by_user.items():
+        await db.exercise_stats.delete_many({"user_id": user_id, "exercise_id": {"$nin": list(totals)}})
+    await db.exercise_stats.delete_many({"user_id": {"$nin": list(totals_by_user)}})
+    await data_versions.bump_all()
+    logging.info(f"Rebuilt {len(documents)} exercise stats for {len(totals_by_user)} users")
+    return totals_by_user
+
+# Delta sync
+# Every write to a synced collection stamps the document with seq, from one
+# atomic counter, and seq_at, the time it was taken; GET /sync returns the
+# records changed since a client's token. A number is allocated just before
+# its document becomes visible, so the token only advances past records older
+# than SYNC_SETTLE seconds and newer ones are sent again on the next sync
+# (clients upsert by id) instead of risking one being skipped. Records are
+# never deleted yet, so "deleted" is always empty.
+SYNC_SEQUENCE_ID = "sync_sequence"
+SYNC_SEQUENCES_MIGRATION_ID = "sync_sequences"
+SYNC_SETTLE = float(os.environ.get('SYNC_SETTLE_SECONDS', '30'))
+DEFAULT_SYNC_LIMIT = 500
+MAX_SYNC_LIMIT = 1000
+SYNC_COLLECTIONS = {
+    "exercises": ("exercises", model_projection(Exercise)),
+    "workouts": ("workout_sessions", SESSION_PROJECTION),
+    "measurements": ("measurements", MEASUREMENT_PROJECTION),
+    "profile": ("user_profiles", PROFILE_PROJECTION),
+}
+SYNC_STAMP_PROJECTION = {"seq": 1, "seq_at": 1, "created_seq": 1}
+
+async def allocate_sequences(count: int = 1):
+    """Reserve count consecutive sequence numbers; returns one stamp per number."""
+    counter = await db.metadata.find_one_and_update(
+        {"_id": SYNC_SEQUENCE_ID}, {"$inc": {"seq": count}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    stamped_at = datetime.now(timezone.utc)
+    first = counter["seq"] - count + 1
+    return [{"seq": first + offset, "seq_at": stamped_at} for offset in range(count)]
+
+async def stamp_sequences(documents):
+    if documents:
+        for document, stamp in zip(documents, await allocate_sequences(len(documents))):
+            document.update(stamp)
+    return documents
+
+async def migrate_sync_sequences():
+    """Stamp documents written before delta sync existed."""
+    if await db.metadata.find_one({"_id": SYNC_SEQUENCES_MIGRATION_ID}):
+        return 0
+    stamped = 0
+    for collection_name, _ in SYNC_COLLECTIONS.values():
+        collection = db[collection_name]
+        # Walk in _id order rather than re-querying for unstamped documents,
+        # which would rescan everything stamped so far on every batch
+        query = {}
+        while True:
+            batch = await collection.find(query, {"_id": 1, "seq": 1}).sort("_id", ASCENDING).limit(
+                MIGRATION_BATCH_SIZE
+            ).to_list(length=None)
+            if not batch:
+                break
+            query = {"_id": {"$gt": batch[-1]["_id"]}}
+            unstamped = [doc for doc in batch if "seq" not in doc]
+            if not unstamped:
+                continue
+            stamps = await allocate_sequences(len(unstamped))
+            await collection.bulk_write([
+                UpdateOne({"_id": doc["_id"], "seq": {"$exists": False}}, {"$set": stamp})
+                for doc, stamp in zip(unstamped, stamps)
+            ], ordered=False)
+            stamped += len(unstamped)
+    if stamped:
+        logging.info(f"Stamped {stamped} documents with sync sequence numbers")
+    await db.metadata.update_one(
+        {"_id": SYNC_SEQUENCES_MIGRATION_ID}, {"$set": {"applied_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+    return stamped
+
+async def load_changes(reader, collection_name: str, projection, user_id: str, since: int, limit: int):
+    query = {"seq": {"$gt": since}}
+    if collection_name != "exercises":
+        query["user_id"] = user_id
+    return await reader[collection_name].find(query, {**projection, **SYNC_STAMP_PROJECTION}).sort(
+        "seq", ASCENDING
+    ).limit(limit + 1).to_list(length=None)
+
+def sync_response(results, since: int, limit: int):
+    settled_before = datetime.now(timezone.utc) - timedelta(seconds=SYNC_SETTLE)
+    settled = since
+    caps = []
+    changes = {}
+    for name, docs in results.items():
+        if len(docs) > limit:
+            docs = docs[:limit]
+            caps.append(docs[-1]["seq"])
+        inserted, updated = [], []
+        for doc in docs:
+            seq = doc.pop("seq")
+            created_seq = doc.pop("created_seq", seq)
+            if as_utc(doc.pop("seq_at")) <= settled_before:
+                settled = max(settled, seq)
+            (inserted if created_seq > since else updated).append(from_document(doc))
+        changes[name] = {"inserted": inserted, "updated": updated, "deleted": []}
+    token = min([settled, *caps])
+    if caps and token <= since:
+        # Paging through a backlog younger than the settle window: move on
+        # rather than return the same page forever.
+        token = min(caps)
+    return {"token": token, "has_more": bool(caps), "changes": changes}
+
+# Bulk ingestion
+# Offline clients sync batches as a JSON array or NDJSON body. Items are
+# validated in one pass and written with a single unordered insert_many; the
+# item id is the document _id, so retried items come back as "duplicate",
+# and an id already taken by another user as "conflict".
+#
+# Workout sessions are inserted marked unapplied, and the mark is cleared once
+# the derived views (stats rollups, exercise stats, leaderboards) include
+# them. A retry that finds its own session still marked, because the first
+# attempt died in between, claims it and applies it as created.
+MAX_BULK_ITEMS = 1000
+DUPLICATE_KEY_ERROR = 11000
+UNAPPLIED_FIELD = "unapplied"
+
+async def claim_unapplied(collection, doc_id: str, user_id: str):
+    result = await collection.update_one(
+        {"_id": doc_id, "user_id": user_id, UNAPPLIED_FIELD: True}, {"$unset": {UNAPPLIED_FIELD: ""}}
+    )
+    return result.modified_count == 1
+
+async def mark_applied(collection, records):
+    if records:
+        await collection.update_many(
+            {"_id": {"$in": [record.id for record in records]}, UNAPPLIED_FIELD: True},
+            {"$unset": {UNAPPLIED_FIELD: ""}},
+        )
+
+def stored_record(model, stored):
+    return model(**from_document({
+        key: value for key, value in stored.items() if key not in ("user_id", UNAPPLIED_FIELD)
+    }))
+
+async def read_bulk_body(request: Request):
+    body = await request.body()
+    try:
+        if "ndjson" in request.headers.get("content-type", ""):
+            items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            items = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array or NDJSON body")
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} items per batch")
+    return items
+
+async def ingest_bulk(collection, model, items, user_id: str, track_applied: bool = False):
+    results: List[BulkItemResult] = []
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            with timed_section("validation"):
+                record = model.model_validate(item)
+        except ValidationError as e:
+            results.append(BulkItemResult(index=index, status="invalid", error=str(e)))
+            continue
+        results.append(BulkItemResult(index=index, id=record.id, status="created"))
+        valid.append((index, record))
+
+    failed = {}
+    if valid:
+        documents = [to_document(record, user_id) for _, record in valid]
+        if track_applied:
+            for document in documents:
+                document[UNAPPLIED_FIELD] = True
+        await stamp_sequences(documents)
+        try:
+            await collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            failed = {error["index"]: error for error in e.details.get("writeErrors", [])}
+
+    duplicate_ids = [
+        valid[position][1].id for position, error in failed.items() if error.get("code") == DUPLICATE_KEY_ERROR
+    ]
+    stored = {}
+    if duplicate_ids:
+        projection = {**model_projection(model), "user_id": 1, UNAPPLIED_FIELD: 1}
+        async for document in collection.find({"_id": {"$in": duplicate_ids}}, projection):
+            stored[document["_id"]] = document
+
+    result_by_index = {r.index: r for r in results}
+    created = []
+    for position, (index, record) in enumerate(valid):
+        error = failed.get(position)
+        if error is None:
+            created.append(record)
+        elif error.get("code") == DUPLICATE_KEY_ERROR:
+            existing = stored.get(record.id)
+            if existing is None or existing.get("user_id") != user_id:
+                result_by_index[index].status = "conflict"
+            elif track_applied and existing.get(UNAPPLIED_FIELD) and await claim_unapplied(
+                collection, record.id, user_id
+            ):
+                created.append(stored_record(model, existing))
+            else:
+                result_by_index[index].status = "duplicate"
+        else:
+            result_by_index[index].status = "invalid"
+            result_by_index[index].error = error.get("errmsg")
+
+    bulk_result = BulkResult(
+        created=len(created),
+        duplicates=sum(1 for r in results if r.status == "duplicate"),
+        conflicts=sum(1 for r in results if r.status == "conflict"),
+        invalid=sum(1 for r in results if r.status == "invalid"),
+        results=results,
+    )
+    return bulk_result, created
+
+# Streaming export
+# History is read with a bounded cursor batch size and written out in chunks,
+# so memory stays flat regardless of how many documents are exported.
+EXPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_COLUMNS = {
+    "workout_sessions": ["id", "date", "created_at", "total_duration", "difficulty_rating",
+                         "energy_level", "notes", "exercises_completed"],
+    "measurements": ["id", "date", "created_at", "measurement", "notes"],
+}
+
+async def export_rows(collection, user_id: str, export_format: str,
+                      from_date: Optional[datetime], to_date: Optional[datetime]):
+    filter_query = {"user_id": user_id}
+    created_range = created_at_range(from_date, to_date)
+    if created_range:
+        filter_query["created_at"] = created_range
+    columns = EXPORT_COLUMNS[collection.name]
+    cursor = collection.find(filter_query, {column: 1 for column in columns if column != "id"}).sort(
+        [("created_at", 1), ("_id", 1)]
+    ).batch_size(EXPORT_BATCH_SIZE)
+
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        async for doc in cursor:
+            doc = from_document(doc)
+            writer.writerow([
+                json.dumps(doc.get(column), ensure_ascii=False) if isinstance(doc.get(column), (list, dict))
+                else doc[column].isoformat() if isinstance(doc.get(column), datetime)
+                else doc.get(column)
+                for column in columns
+            ])
+            if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+    else:
+        chunk = bytearray()
+        async for doc in cursor:
+            chunk += dumps_json(from_document(doc))
+            chunk += b"\n"
+            if len(chunk) >= EXPORT_CHUNK_BYTES:
+                yield bytes(chunk)
+                chunk.clear()
+        if chunk:
+            yield bytes(chunk)
+
+async def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def export_response(collection, user_id: str, filename: str, export_format: str, gzip: bool,
+                    from_date: Optional[datetime], to_date: Optional[datetime]):
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    filename = f"{filename}.{export_format}"
+    chunks = export_rows(collection, user_id, export_format, from_date, to_date)
+    if gzip:
+        media_type = "application/gzip"
+        filename += ".gz"
+        chunks = gzip_chunks(chunks)
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+# Trends analytics
+# Columns are pulled with one projected query per collection (or memory-mapped
+# from the columnar snapshot, see below) and every statistic is computed with
+# vectorized NumPy. Results are cached per
+# (user, range, granularity, window) until the user's next session or
+# measurement write.
+TREND_GRANULARITIES = ("week", "month")
+TRENDS_CACHE_SIZE = 128
+trends_cache: Dict[tuple, Dict[str, Any]] = {}
+series_cache: Dict[tuple, Dict[str, Any]] = {}
+
+def invalidate_trends(user_id: str):
+    for cache in (trends_cache, series_cache):
+        for key in [key for key in cache if key[0] == user_id]:
+            del cache[key]
+
+def cache_result(cache: Dict[tuple, Dict[str, Any]], key: tuple, result: Dict[str, Any]):
+    if len(cache) >= TRENDS_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+    cache[key] = result
+
+def to_datetime64(values):
+    return np.array([as_utc(v).replace(tzinfo=None) for v in values], dtype="datetime64[s]")
+
+def created_at_mask(created_at, from_date: Optional[datetime], to_date: Optional[datetime]):
+    mask = np.ones(len(created_at), dtype=bool)
+    if from_date:
+        mask &= created_at >= to_datetime64([from_date])[0]
+    if to_date:
+        mask &= created_at < to_datetime64([to_date])[0]
+    return mask
+
+def optional_floats(values):
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+def completed_exercise_ids(entries):
+    return [
+        entry["exercise_id"] for entry in entries or []
+        if isinstance(entry, dict) and isinstance(entry.get("exercise_id"), str)
+    ]
+
+def session_columns(sessions, exercise_ids: Optional[List[str]] = None):
+    """Build trend columns from session documents; exercise ids are dictionary-encoded."""
+    exercise_ids = list(exercise_ids or [])
+    exercise_codes = {exercise_id: code for code, exercise_id in enumerate(exercise_ids)}
+    codes: List[int] = []
+    offsets = [0]
+    for session in sessions:
+        for exercise_id in completed_exercise_ids(session.get("exercises_completed")):
+            if exercise_id not in exercise_codes:
+                exercise_codes[exercise_id] = len(exercise_ids)
+                exercise_ids.append(exercise_id)
+            codes.append(exercise_codes[exercise_id])
+        offsets.append(len(codes))
+    return {
+        "created_at": to_datetime64([s["created_at"] for s in sessions]),
+        "total_duration": np.array([s.get("total_duration") or 0 for s in sessions], dtype=float),
+        "difficulty_rating": optional_floats([s.get("difficulty_rating") for s in sessions]),
+        "energy_level": optional_floats([s.get("energy_level") for s in sessions]),
+        "exercise_offsets": np.array(offsets, dtype=np.int64),
+        "exercise_codes": np.array(codes, dtype=np.int32),
+        "exercise_ids": exercise_ids,
+    }
+
+def select_sessions(columns, mask):
+    counts = np.diff(columns["exercise_offsets"])
+    return {
+        "created_at": columns["created_at"][mask],
+        "total_duration": columns["total_duration"][mask],
+        "difficulty_rating": columns["difficulty_rating"][mask],
+        "energy_level": columns["energy_level"][mask],
+        "exercise_offsets": np.concatenate(([0], np.cumsum(counts[mask]))).astype(np.int64),
+        "exercise_codes": columns["exercise_codes"][np.repeat(mask, counts)],
+        "exercise_ids": columns["exercise_ids"],
+    }
+
+SESSION_TREND_PROJECTION = {
+    "_id": 0, "created_at": 1, "total_duration": 1, "difficulty_rating": 1,
+    "energy_level": 1, "exercises_completed.exercise_id": 1,
+}
+
+async def load_trend_columns(user_id: str, from_date: Optional[datetime], to_date: Optional[datetime], reader=None):
+    reader = reader if reader is not None else db
+    filter_query = {"user_id": user_id}
+    created_range = created_at_range(from_date, to_date)
+    if created_range:
+        filter_query["created_at"] = created_range
+    if snapshot_store:
+        sessions = await load_snapshot_columns(user_id)
+        sessions = select_sessions(sessions, created_at_mask(sessions["created_at"], from_date, to_date))
+    else:
+        sessions = session_columns(
+            await reader.workout_sessions.find(filter_query, SESSION_TREND_PROJECTION).to_list(length=None)
+        )
+    measurements = await reader.measurements.find(
+        filter_query, {"_id": 0, "created_at": 1, "measurement": 1}
+    ).to_list(length=None)
+    return sessions, {
+        "created_at": to_datetime64([m["created_at"] for m in measurements]),
+        "measurement": np.array([m["measurement"] for m in measurements], dtype=float),
+    }
+
+def top_exercises(sessions, limit: int = 10):
+    if not len(sessions["exercise_codes"]):
+        return []
+    counts = np.bincount(sessions["exercise_codes"], minlength=len(sessions["exercise_ids"]))
+    exercise_ids = sessions["exercise_ids"]
+    order = sorted(np.flatnonzero(counts), key=lambda code: (-counts[code], exercise_ids[code]))[:limit]
+    return [{"exercise_id": exercise_ids[code], "count": int(counts[code])} for code in order]
+
+def period_starts(created_at, granularity: str):
+    days = created_at.astype("datetime64[D]")
+    if granularity == "month":
+        return days.astype("datetime64[M]").astype("datetime64[D]")
+    # 1970-01-01 was a Thursday; shift so weeks start on Monday
+    day_numbers = days.astype(np.int64)
+    return ((day_numbers - 4) // 7 * 7 + 4).astype("datetime64[D]")
+
+def nanmean_by_group(values, inverse, groups):
+    present = ~np.isnan(values)
+    sums = np.bincount(inverse, weights=np.where(present, values, 0.0), minlength=groups)
+    counts = np.bincount(inverse, weights=present.astype(float), minlength=groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+def moving_average(values, window: int):
+    present = ~np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(present, values, 0.0))))
+    counts = np.concatenate(([0.0], np.cumsum(present)))
+    lower = np.maximum(np.arange(1, len(values) + 1) - window, 0)
+    upper = np.arange(1, len(values) + 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums[upper] - sums[lower]) / (counts[upper] - counts[lower])
+
+def compute_streaks(created_at, today):
+    if not len(created_at):
+        return {"current": 0, "longest": 0}
+    days = np.unique(created_at.astype("datetime64[D]").astype(np.int64))
+    breaks = np.flatnonzero(np.diff(days) != 1)
+    run_starts = np.concatenate(([0], breaks + 1))
+    run_ends = np.concatenate((breaks, [len(days) - 1]))
+    run_lengths = run_ends - run_starts + 1
+    today_number = np.datetime64(today, "D").astype(np.int64)
+    # A streak is still current if the last workout was today or yesterday
+    current = int(run_lengths[-1]) if today_number - days[-1] <= 1 else 0
+    return {"current": current, "longest": int(run_lengths.max())}
+
+def measurement_trend(created_at, values):
+    if not len(values):
+        return {"count": 0, "first": None, "latest": None, "slope_per_week": None}
+    order = np.argsort(created_at)
+    created_at, values = created_at[order], values[order]
+    slope = None
+    elapsed_days = (created_at - created_at[0]).astype(float) / 86400.0
+    if len(values) > 1 and np.ptp(elapsed_days) > 0:
+        slope = round(float(np.polyfit(elapsed_days, values, 1)[0] * 7), 3)
+    return {
+        "count": int(len(values)),
+        "first": float(values[0]),
+        "latest": float(values[-1]),
+        "slope_per_week": slope,
+    }
+
+def none_if_nan(value):
+    return None if np.isnan(value) else round(float(value), 2)
+
+def compute_trends(sessions, measurements, granularity: str, window: int, today):
+    periods = []
+    if len(sessions["created_at"]):
+        starts = period_starts(sessions["created_at"], granularity)
+        unique_starts, inverse = np.unique(starts, return_inverse=True)
+        groups = len(unique_starts)
+        counts = np.bincount(inverse, minlength=groups)
+        durations = np.bincount(inverse, weights=sessions["total_duration"], minlength=groups)
+        averages = {
+            "duration": durations / counts,
+            "difficulty": nanmean_by_group(sessions["difficulty_rating"], inverse, groups),
+            "energy": nanmean_by_group(sessions["energy_level"], inverse, groups),
+        }
+        moving = {name: moving_average(values, window) for name, values in averages.items()}
+        for i, start in enumerate(unique_starts):
+            periods.append({
+                "period": str(start),
+                "sessions": int(counts[i]),
+                "total_duration": int(durations[i]),
+                **{f"avg_{name}": none_if_nan(values[i]) for name, values in averages.items()},
+                **{f"ma_{name}": none_if_nan(values[i]) for name, values in moving.items()},
+            })
+    return {
+        "granularity": granularity,
+        "window": window,
+        "periods": periods,
+        "streaks": compute_streaks(sessions["created_at"], today),
+        "top_exercises": top_exercises(sessions),
+        "measurements": measurement_trend(measurements["created_at"], measurements["measurement"]),
+    }
+
+# Chart series
+# Long histories are downsampled server side to at most `points` points, so
+# the payload and the phone's render time do not grow with the history.
+# LTTB (largest triangle three buckets) keeps the visual shape of a line;
+# minmax keeps each bucket's extremes, which suits spiky data. Only the one
+# column is fetched, and results share the trends cache invalidation.
+SERIES_METRICS = {
+    "measurement": ("measurements", "measurement"),
+    "total_duration": ("workout_sessions", "total_duration"),
+}
+SERIES_METHODS = ("lttb", "minmax")
+DEFAULT_SERIES_POINTS = 200
+MAX_SERIES_POINTS = 2000
+
+def lttb_indices(x, y, threshold: int):
+    """Indices of the points Largest-Triangle-Three-Buckets keeps; x must be sorted."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # The first and last points are always kept; the rest are split into
+    # threshold - 2 buckets, each contributing the point that forms the
+    # largest triangle with the previous pick and the next bucket's mean.
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    counts = np.diff(edges)
+    mean_x = np.append(np.add.reduceat(x[:-1], edges[:-1]) / counts, x[-1])
+    mean_y = np.append(np.add.reduceat(y[:-1], edges[:-1]) / counts, y[-1])
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x, next_y = mean_x[bucket + 1], mean_y[bucket + 1]
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+def minmax_indices(y, threshold: int):
+    """Indices of each bucket's minimum and maximum, in time order."""
+    n = len(y)
+    if threshold >= n:
+        return np.arange(n)
+    buckets = max(threshold // 2, 1)
+    bucket_ids = np.arange(n) * buckets // n
+    starts = np.searchsorted(bucket_ids, np.arange(buckets))
+    picks = []
+    for extremes in (np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)):
+        hits = np.flatnonzero(y == extremes[bucket_ids])
+        # First hit in each bucket
+        picks.append(hits[np.unique(bucket_ids[hits], return_index=True)[1]])
+    return np.unique(np.concatenate(picks))
+
+async def load_series_column(user_id: str, metric: str, from_date: Optional[datetime],
+                             to_date: Optional[datetime], reader=None):
+    reader = reader if reader is not None else db
+    collection, field = SERIES_METRICS[metric]
+    if collection == "workout_sessions" and snapshot_store:
+        sessions = await load_snapshot_columns(user_id)
+        mask = created_at_mask(sessions["created_at"], from_date, to_date)
+        return sessions["created_at"][mask], sessions[field][mask]
+    filter_query = {"user_id": user_id}
+    created_range = created_at_range(from_date, to_date)
+    if created_range:
+        filter_query["created_at"] = created_range
+    docs = await reader[collection].find(filter_query, {"_id": 0, "created_at": 1, field: 1}).to_list(length=None)
+    return to_datetime64([d["created_at"] for d in docs]), optional_floats([d.get(field) for d in docs])
+
+def compute_series(metric: str, created_at, values, points: int, method: str):
+    present = ~np.isnan(values)
+    created_at, values = created_at[present], values[present]
+    order = np.argsort(created_at, kind="stable")
+    created_at, values = created_at[order], values[order]
+    if method == "lttb":
+        keep = lttb_indices(created_at.astype(np.int64).astype(float), values, points)
+    else:
+        keep = minmax_indices(values, points)
+    return {
+        "metric": metric,
+        "method": method,
+        "total_points": int(len(values)),
+        "timestamps": np.datetime_as_string(created_at[keep], unit="s", timezone="UTC").tolist(),
+        "values": values[keep].tolist(),
+    }
+
+# Leaderboards
+# Rankings are kept in memory as sorted (-score, member) lists, so top-K and a
+# member's rank are O(log n) lookups. Scores derive from data that is already
+# persisted on every write: weekly time and streaks from the per-user stats
+# rollups, exercise counts from exercise_stats. That makes those collections
+# the snapshot: boards are rebuilt from them at startup, every
+# LEADERBOARD_TTL seconds (picking up other workers' writes) and when the
+# day changes, and updated in place by writes through this process.
+LEADERBOARD_KINDS = ("weekly_time", "streaks", "exercises")
+LEADERBOARD_TTL = float(os.environ.get('LEADERBOARD_TTL_SECONDS', '60'))
+MAX_LEADERBOARD_SIZE = 100
+
+class RankedSet:
+    def __init__(self, scores: Optional[Dict[str, int]] = None):
+        self.scores: Dict[str, int] = {member: score for member, score in (scores or {}).items() if score > 0}
+        self.ranking = SortedList((-score, member) for member, score in self.scores.items())
+
+    def __len__(self):
+        return len(self.scores)
+
+    def set(self, member: str, score: int):
+        previous = self.scores.pop(member, None)
+        if previous is not None:
+            self.ranking.remove((-previous, member))
+        if score > 0:
+            self.scores[member] = score
+            self.ranking.add((-score, member))
+
+    def add(self, member: str, delta: int):
+        self.set(member, self.scores.get(member, 0) + delta)
+
+    def top(self, limit: int):
+        return [(member, -negated) for negated, member in self.ranking.islice(0, limit)]
+
+    def rank(self, member: str):
+        """1-based rank, or None when the member has no score."""
+        score = self.scores.get(member)
+        if score is None:
+            return None
+        return self.ranking.bisect_left((-score, member)) + 1
+
+def week_start(day: date):
+    return day - timedelta(days=day.weekday())
+
+def weekly_seconds(rollup, start: date):
+    first_day = start.isoformat()
+    return sum(bucket.get("duration", 0) for day, bucket in rollup.get("daily", {}).items() if day >= first_day)
+
+def public_member(user_id: str):
+    return hashlib.sha1(user_id.encode()).hexdigest()[:12]
+
+class Leaderboards:
+    def __init__(self, ttl: float = LEADERBOARD_TTL):
+        self.ttl = ttl
+        self.day: Optional[date] = None
+        self.loaded_at = 0.0
+        self.boards: Dict[str, RankedSet] = {kind: RankedSet() for kind in LEADERBOARD_KINDS}
+        self._lock = asyncio.Lock()
+
+    async def load(self):
+        today = datetime.now(timezone.utc).date()
+        weekly: Dict[str, int] = {}
+        streaks: Dict[str, int] = {}
+        cursor = db.workout_stats.find({}, {"daily": 1, "streak_start": 1, "streak_end": 1})
+        async for rollup in cursor:
+            weekly[rollup["_id"]] = weekly_seconds(rollup, week_start(today))
+            streaks[rollup["_id"]] = active_streak(rollup, today)
+        pipeline = [{"$group": {"_id": "$exercise_id", "count": {"$sum": "$count"}}}]
+        exercises = {row["_id"]: row["count"] for row in await db.exercise_stats.aggregate(pipeline).to_list(length=None)}
+        self.boards = {
+            "weekly_time": RankedSet(weekly),
+            "streaks": RankedSet(streaks),
+            "exercises": RankedSet(exercises),
+        }
+        self.day = today
+        self.loaded_at = time.monotonic()
+        logging.info(f"Loaded leaderboards for {len(weekly)} users and {len(exercises)} exercises")
+
+    async def refresh(self):
+        """Rebuild when the TTL has expired or the day changed; other requests keep serving meanwhile."""
+        today = datetime.now(timezone.utc).date()
+        if today == self.day and time.monotonic() - self.loaded_at < self.ttl:
+            return
+        if self._lock.locked() and today == self.day:
+            return
+        async with self._lock:
+            if today != self.day or time.monotonic() - self.loaded_at >= self.ttl:
+                await self.load()
+
+    def record(self, user_id: str, rollup, workouts: List[WorkoutSession]):
+        if self.day is None:
+            return
+        self.boards["weekly_time"].set(user_id, weekly_seconds(rollup, week_start(self.day)))
+        self.boards["streaks"].set(user_id, active_streak(rollup, self.day))
+        exercises = self.boards["exercises"]
+        for workout in workouts:
+            for exercise_id in completed_exercise_ids(workout.exercises_completed):
+                exercises.add(exercise_id, 1)
+
+    def entry(self, kind: str, member: str, rank: int, score: int):
+        if kind == "exercises":
+            exercise = exercise_catalog.get(member)
+            return LeaderboardEntry(rank=rank, member=member, score=score, name=exercise.name if exercise else None)
+        return LeaderboardEntry(rank=rank, member=public_member(member), score=score)
+
+    def leaderboard(self, kind: str, limit: int, user_id: str):
+        board = self.boards[kind]
+        entries = [self.entry(kind, member, rank, score) for rank, (member, score) in enumerate(board.top(limit), 1)]
+        me = None
+        if kind != "exercises":
+            rank = board.rank(user_id)
+            if rank is not None:
+                me = self.entry(kind, user_id, rank, board.scores[user_id])
+        period = week_start(self.day).isoformat() if kind == "weekly_time" else None
+        return Leaderboard(kind=kind, period=period, entries=entries, me=me)
+
+leaderboards = Leaderboards()
+
+# Columnar workout snapshots
+# With COLUMNAR_SNAPSHOT_DIR set, each user's workout history is kept on local
+# disk as one raw little-endian file per column, memory-mapped on read so
+# trend scans never read history from Mongo. meta.json records how many rows
+# are valid and is replaced atomically after every append, so readers ignore
+# partially written tails; appends are serialized across workers with flock.
+# Each read first catches up with sessions whose sync sequence number is above
+# the snapshot's high-water mark (one indexed query). The mark only advances
+# past sessions older than SYNC_SETTLE, so an insert still in flight when the
+# snapshot was built or caught up is picked up by a later read; sessions
+# appended above the mark are remembered in meta.json so they are not appended
+# twice. manage.py rebuild-snapshots recreates them from Mongo.
+# A build never rewrites files a reader may have mapped: it writes a new
+# generation of column files, publishes it by replacing meta.json, and only
+# then removes the previous generation.
+SNAPSHOT_ROW_COLUMNS = {
+    "created_at": "<M8[s]",
+    "total_duration": "<f8",
+    "difficulty_rating": "<f8",
+    "energy_level": "<f8",
+}
+
+class ColumnarSnapshotStore:
+    def __init__(self, root: Path):
+        self.root = root
+
+    def user_dir(self, user_id: str):
+        digest = hashlib.sha1(user_id.encode()).hexdigest()
+        return self.root / digest[:2] / digest
+
+    @contextmanager
+    def _locked(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory / ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_meta(self, directory: Path):
+        try:
+            with open(directory / "meta.json") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, directory: Path, meta):
+        tmp = directory / "meta.json.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, directory / "meta.json")
+
+    def _column_path(self, directory: Path, name: str, meta):
+        generation = meta.get("generation")
+        return directory / (f"{name}.bin" if generation is None else f"{name}.{generation}.bin")
+
+    def _remove_stale_generations(self, directory: Path, generation: int):
+        for path in directory.glob("*.bin"):
+            if path.name.split(".")[-2] != str(generation):
+                path.unlink(missing_ok=True)
+
+    def _write_column(self, path: Path, values, start_row: int, dtype: str):
+        data = np.ascontiguousarray(values, dtype=dtype)
+        mode = "r+b" if path.exists() else "wb"
+        with open(path, mode) as f:
+            f.seek(start_row * data.itemsize)
+            f.write(data.tobytes())
+            f.truncate()
+
+    def _write(self, directory: Path, columns, meta):
+        rows, exercise_rows = meta["rows"], meta["exercise_rows"]
+        for name, dtype in SNAPSHOT_ROW_COLUMNS.items():
+            self._write_column(self._column_path(directory, name, meta), columns[name], rows, dtype)
+        offsets = columns["exercise_offsets"][1:] + exercise_rows
+        self._write_column(self._column_path(directory, "exercise_offsets", meta), offsets, rows, "<i8")
+        self._write_column(
+            self._column_path(directory, "exercise_codes", meta), columns["exercise_codes"], exercise_rows, "<i4"
+        )
+        self._write_meta(directory, {
+            **meta,
+            "rows": rows + len(columns["created_at"]),
+            "exercise_rows": exercise_rows + len(columns["exercise_codes"]),
+            "exercise_ids": columns["exercise_ids"],
+        })
+
+    def high_water(self, user_id: str):
+        """The snapshot's high-water sequence number, or None when it has to be built."""
+        meta = self._read_meta(self.user_dir(user_id))
+        return meta.get("seq") if meta else None
+
+    def build(self, user_id: str, sessions, high_water: int):
+        directory = self.user_dir(user_id)
+        recent = sorted(session["seq"] for session in sessions if session["seq"] > high_water)
+        with self._locked(directory):
+            generation = (self._read_meta(directory) or {}).get("generation", 0) + 1
+            self._write(directory, session_columns(sessions), {
+                "rows": 0, "exercise_rows": 0, "seq": high_water, "recent_seqs": recent, "generation": generation,
+            })
+            self._remove_stale_generations(directory, generation)
+
+    def append(self, user_id: str, sessions, high_water: int):
+        """Append sessions not in the snapshot yet; returns False when the user has no snapshot."""
+        directory = self.user_dir(user_id)
+        with self._locked(directory):
+            meta = self._read_meta(directory)
+            if meta is None or "seq" not in meta:
+                return False
+            recent = set(meta["recent_seqs"])
+            sessions = [s for s in sessions if s["seq"] > meta["seq"] and s["seq"] not in recent]
+            if not sessions and high_water <= meta["seq"]:
+                return True
+            high_water = max(high_water, meta["seq"])
+            meta["seq"] = high_water
+            meta["recent_seqs"] = sorted(seq for seq in recent.union(s["seq"] for s in sessions) if seq > high_water)
+            self._write(directory, session_columns(sessions, meta["exercise_ids"]), meta)
+            return True
+
+    def _map(self, path: Path, dtype: str, rows: int):
+        if rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(rows,))
+
+    def load(self, user_id: str):
+        directory = self.user_dir(user_id)
+        while True:
+            meta = self._read_meta(directory)
+            if meta is None:
+                return None
+            try:
+                return self._map_columns(directory, meta)
+            except FileNotFoundError:
+                # A rebuild published a new generation and removed this one
+                if self._read_meta(directory) == meta:
+                    raise
+
+    def _map_columns(self, directory: Path, meta):
+        rows = meta["rows"]
+        columns = {
+            name: self._map(self._column_path(directory, name, meta), dtype, rows)
+            for name, dtype in SNAPSHOT_ROW_COLUMNS.items()
+        }
+        offsets = self._map(self._column_path(directory, "exercise_offsets", meta), "<i8", rows)
+        columns["exercise_offsets"] = np.concatenate(([0], offsets)).astype(np.int64)
+        columns["exercise_codes"] = self._map(
+            self._column_path(directory, "exercise_codes", meta), "<i4", meta["exercise_rows"]
+        )
+        columns["exercise_ids"] = meta["exercise_ids"]
+        return columns
+
+snapshot_store = (
+    ColumnarSnapshotStore(Path(os.environ['COLUMNAR_SNAPSHOT_DIR']))
+    if os.environ.get('COLUMNAR_SNAPSHOT_DIR') else None
+)
+
+SNAPSHOT_SESSION_PROJECTION = {**SESSION_TREND_PROJECTION, "seq": 1, "seq_at": 1}
+
+def settled_high_water(sessions, floor: int = 0):
+    """Highest seq among sessions stamped more than SYNC_SETTLE ago; every lower seq is visible by then."""
+    settled_before = datetime.now(timezone.utc) - timedelta(seconds=SYNC_SETTLE)
+    return max([floor, *(s["seq"] for s in sessions if as_utc(s["seq_at"]) <= settled_before)])
+
+async def build_snapshot(user_id: str):
+    sessions = await db.workout_sessions.find(
+        {"user_id": user_id}, SNAPSHOT_SESSION_PROJECTION
+    ).sort([("created_at", 1), ("_id", 1)]).to_list(length=None)
+    await asyncio.to_thread(snapshot_store.build, user_id, sessions, settled_high_water(sessions))
+    return len(sessions)
+
+async def catch_up_snapshot(user_id: str, high_water: int):
+    sessions = await db.workout_sessions.find(
+        {"user_id": user_id, "seq": {"$gt": high_water}}, SNAPSHOT_SESSION_PROJECTION
+    ).sort("seq", ASCENDING).to_list(length=None)
+    if sessions:
+        return await asyncio.to_thread(
+            snapshot_store.append, user_id, sessions, settled_high_water(sessions, high_water)
+        )
+    return True
+
+async def load_snapshot_columns(user_id: str):
+    high_water = await asyncio.to_thread(snapshot_store.high_water, user_id)
+    if high_water is None or not await catch_up_snapshot(user_id, high_water):
+        await build_snapshot(user_id)
+    return await asyncio.to_thread(snapshot_store.load, user_id)
+
+async def rebuild_snapshots():
+    user_ids = await db.workout_sessions.distinct("user_id")
+    for user_id in user_ids:
+        await build_snapshot(user_id)
+    logging.info(f"Rebuilt columnar snapshots for {len(user_ids)} users")
+    return len(user_ids)
+
+async def record_sessions_written(user_id: str, workouts: List[WorkoutSession]):
+    """Apply newly stored sessions to every derived view; returns the updated stats rollup."""
+    rollup, _ = await asyncio.gather(
+        record_workout_stats(user_id, workouts),
+        record_exercise_stats(user_id, workouts),
+    )
+    if workouts:
+        rollup = await record_streak(user_id, rollup, workouts)
+        leaderboards.record(user_id, rollup, workouts)
+        invalidate_trends(user_id)
+        await data_versions.bump(user_id)
+    return rollup
+
+# Write-behind buffer for workout sessions
+# With WRITE_BEHIND=1, create_workout_session enqueues the validated session
+# and responds immediately; a background task group-commits the queue with
+# insert_many once WRITE_BEHIND_BATCH_SIZE sessions are waiting or
+# WRITE_BEHIND_FLUSH_INTERVAL seconds have passed. A full queue applies
+# backpressure and, after WRITE_BEHIND_PUT_TIMEOUT seconds, answers 503.
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+
+class WriteBehindBuffer:
+    def __init__(self, max_queue: int, batch_size: int, flush_interval: float,
+                 put_timeout: float, max_retries: int = 3):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.metrics = {
+            "enqueued": 0,
+            "rejected": 0,
+            "flushes": 0,
+            "flushed": 0,
+            "duplicates": 0,
+            "dropped": 0,
+            "queue_high_water": 0,
+            "flush_seconds_total": 0.0,
+            "flush_seconds_last": 0.0,
+            "flush_seconds_max": 0.0,
+        }
+
+    @property
+    def running(self):
+        return self.task is not None
+
+    def snapshot(self):
+        return {
+            **self.metrics,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "queue_capacity": self.max_queue,
+        }
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.task = asyncio.create_task(self._run())
+        logging.info(f"Write-behind buffer started (capacity {self.max_queue}, batch {self.batch_size})")
+
+    async def stop(self):
+        """Flush everything still queued, then stop the background task."""
+        if not self.task:
+            return
+        await self.queue.join()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        logging.info("Write-behind buffer flushed and stopped")
+
+    async def put(self, user_id: str, workout: WorkoutSession, document: Dict[str, Any]):
+        try:
+            await asyncio.wait_for(self.queue.put((user_id, workout, document)), self.put_timeout)
+        except asyncio.TimeoutError:
+            self.metrics["rejected"] += 1
+            raise HTTPException(status_code=503, detail="Workout write buffer is full, retry later")
+        self.metrics["enqueued"] += 1
+        self.metrics["queue_high_water"] = max(self.metrics["queue_high_water"], self.queue.qsize())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            except Exception:
+                logging.exception(f"Write-behind flush of {len(batch)} sessions failed")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _already_written(self, documents, failed):
+        """Drop duplicate-key errors for documents an earlier, interrupted attempt did insert."""
+        duplicates = {
+            documents[position]["_id"]: position
+            for position, error in failed.items() if error.get("code") == DUPLICATE_KEY_ERROR
+        }
+        if duplicates:
+            # Our own copy carries the sequence number stamped for this flush
+            async for stored in db.workout_sessions.find({"_id": {"$in": list(duplicates)}}, {"seq": 1}):
+                position = duplicates[stored["_id"]]
+                if stored.get("seq") == documents[position]["seq"]:
+                    del failed[position]
+        return failed
+
+    async def _flush(self, batch):
+        started = time.perf_counter()
+        failed = {}
+        documents = [document for _, _, document in batch]
+        try:
+            await stamp_sequences(documents)
+        except Exception:
+            self.metrics["dropped"] += len(batch)
+            raise
+        for attempt in range(self.max_retries + 1):
+            try:
+                await db.workout_sessions.insert_many(documents, ordered=False)
+                break
+            except BulkWriteError as e:
+                failed = {error["index"]: error for error in e.details.get("writeErrors", [])}
+                if attempt:
+                    failed = await self._already_written(documents, failed)
+                break
+            except PyMongoError:
+                if attempt == self.max_retries:
+                    self.metrics["dropped"] += len(batch)
+                    raise
+                await asyncio.sleep(0.1 * 2 ** attempt)
+
+        inserted: Dict[str, List[WorkoutSession]] = {}
+        for position, (user_id, workout, _) in enumerate(batch):
+            error = failed.get(position)
+            if error is None:
+                inserted.setdefault(user_id, []).append(workout)
+            elif error.get("code") == DUPLICATE_KEY_ERROR:
+                self.metrics["duplicates"] += 1
+            else:
+                self.metrics["dropped"] += 1
+                logging.error(f"Write-behind insert of session {workout.id} failed: {error.get('errmsg')}")
+        for user_id, workouts in inserted.items():
+            await record_sessions_written(user_id, workouts)
+
+        elapsed = time.perf_counter() - started
+        self.metrics["flushes"] += 1
+        self.metrics["flushed"] += sum(len(workouts) for workouts in inserted.values())
+        self.metrics["flush_seconds_total"] += elapsed
+        self.metrics["flush_seconds_last"] = elapsed
+        self.metrics["flush_seconds_max"] = max(self.metrics["flush_seconds_max"], elapsed)
+
+write_behind = WriteBehindBuffer(
+    max_queue=int(os.environ.get('WRITE_BEHIND_MAX_QUEUE', '1000')),
+    batch_size=int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', '200')),
+    flush_interval=float(os.environ.get('WRITE_BEHIND_FLUSH_INTERVAL', '0.25')),
+    put_timeout=float(os.environ.get('WRITE_BEHIND_PUT_TIMEOUT', '2')),
+)
+
+# Exercise catalog data
+# The seeded catalog lives in exercise_catalog.json, keyed by stable slugs.
+# Startup compares the file's version with the one recorded in metadata and,
+# when the file is newer, writes only the new or changed entries in one
+# bulk_write of upserts. New exercises get an id derived from their slug, so
+# the same entry has the same id in every database; existing ones keep theirs.
+# Entries dropped from the file are left in place, since history refers to them.
+EXERCISE_CATALOG_PATH = Path(os.environ.get('EXERCISE_CATALOG_PATH', ROOT_DIR / 'exercise_catalog.json'))
+EXERCISE_CATALOG_DATA_ID = "exercise_catalog_data"
+CATALOG_ID_NAMESPACE = uuid.UUID("6f1c2a4e-8d3b-5a7f-9e21-4b6d8c0f3a15")
+
+def catalog_exercise_id(slug: str):
+    return str(uuid.uuid5(CATALOG_ID_NAMESPACE, slug))
+
+def kept_created_seq(existing: Dict[str, Any]):
+    """created_seq for a restamped document that predates it, so delta sync reports an update."""
+    return {} if "created_seq" in existing else {"created_seq": existing.get("seq", 0)}
+
+def load_catalog_file(path: Path = EXERCISE_CATALOG_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def catalog_entries(data):
+    """{slug: stored fields} for every entry in the file, validated against Exercise."""
+    entries = {}
+    for entry in data["exercises"]:
+        document = to_document(Exercise(id=catalog_exercise_id(entry["slug"]), **entry))
+        del document["_id"], document["created_at"]
+        entries[entry["slug"]] = document
+    return entries
+
+def catalog_upsert(slug: str, fields, stamp, existing: Optional[Dict[str, Any]], now: datetime):
+    if existing is not None:
+        return UpdateOne({"slug": slug}, {"$set": {**fields, **stamp, **kept_created_seq(existing)}})
+    return UpdateOne({"slug": slug}, {
+        "$set": {**fields, **stamp},
+        "$setOnInsert": {"_id": catalog_exercise_id(slug), "created_at": now, "created_seq": stamp["seq"]},
+    }, upsert=True)
+
+async def apply_exercise_catalog(path: Path = EXERCISE_CATALOG_PATH):
+    data = load_catalog_file(path)
+    version = data["version"]
+    applied = await db.metadata.find_one({"_id": EXERCISE_CATALOG_DATA_ID})
+    if applied and applied.get("version", 0) >= version:
+        return 0
+    entries = catalog_entries(data)
+    current = {
+        doc["slug"]: doc
+        async for doc in db.exercises.find({"slug": {"$in": list(entries)}}, {"_id": 0, "seq_at": 0})
+    }
+    changed = [
+        (slug, fields) for slug, fields in entries.items()
+        if any(current.get(slug, {}).get(key) != value for key, value in fields.items())
+    ]
+    if changed:
+        now = datetime.now(timezone.utc)
+        stamps = await allocate_sequences(len(changed))
+        try:
+            await db.exercises.bulk_write([
+                catalog_upsert(slug, fields, stamp, current.get(slug), now)
+                for (slug, fields), stamp in zip(changed, stamps)
+            ], ordered=False)
+        except BulkWriteError as e:
+            # Another worker starting at the same time inserted the same slug
+            if any(error.get("code") != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+                raise
+        await bump_catalog_version()
+    await db.metadata.update_one(
+        {"_id": EXERCISE_CATALOG_DATA_ID},
+        {"$set": {"version": version, "applied_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+    logging.info(f"Applied exercise catalog version {version} ({len(changed)} of {len(entries)} entries changed)")
+    return len(changed)
+
+async def assign_exercise_slugs(path: Path = EXERCISE_CATALOG_PATH):
+    """Give exercises seeded before the catalog file their slug, matched by name, so they keep their ids."""
+    slugs = {entry["name"]: entry["slug"] for entry in load_catalog_file(path)["exercises"]}
+    unslugged = await db.exercises.find(
+        {"slug": {"$exists": False}}, {"name": 1, "seq": 1, "created_seq": 1}
+    ).to_list(length=None)
+    matched = [doc for doc in unslugged if doc.get("name") in slugs]
+    updates = [
+        UpdateOne({"_id": doc["_id"]}, {"$set": {"slug": slugs[doc["name"]], **stamp, **kept_created_seq(doc)}})
+        for doc, stamp in zip(matched, await allocate_sequences(len(matched)) if matched else [])
+    ]
+    if updates:
+        await db.exercises.bulk_write(updates, ordered=False)
+        logging.info(f"Assigned catalog slugs to {len(updates)} exercises")
+
+# Migrations
+# One-off schema and data migrations run in order at startup; the last
+# applied number is kept in metadata, so a current database costs a single
+# read. Each migration must be safe to run again after an interrupted start.
+# Workers starting at once are serialized by a lease document in metadata:
+# one takes it and runs the migrations while the others wait for
+# schema_version to reach the latest number. The lease expires, so a worker
+# that dies part way is taken over by the next one to check.
+SCHEMA_VERSION_ID = "schema_version"
+MIGRATION_LEASE_ID = "migration_lease"
+MIGRATION_LEASE_SECONDS = float(os.environ.get('MIGRATION_LEASE_SECONDS', '300'))
+MIGRATION_WAIT_SECONDS = 0.5
+MIGRATIONS = [
+    (1, assign_default_user),
+    (2, migrate_compact_documents),
+    (3, migrate_sync_sequences),
+    (4, assign_exercise_slugs),
+]
+
+async def schema_version():
+    state = await db.metadata.find_one({"_id": SCHEMA_VERSION_ID})
+    return state["version"] if state else 0
+
+async def take_migration_lease(owner: str):
+    """Take or renew the migration lease; False while another worker holds it."""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.metadata.find_one_and_update(
+            {"_id": MIGRATION_LEASE_ID, "$or": [{"owner": owner}, {"expires_at": {"$lte": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=MIGRATION_LEASE_SECONDS)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+async def run_migrations():
+    latest = MIGRATIONS[-1][0]
+    owner = str(uuid.uuid4())
+    while True:
+        if await schema_version() >= latest:
+            return 0
+        if await take_migration_lease(owner):
+            break
+        await asyncio.sleep(MIGRATION_WAIT_SECONDS)
+
+    applied = 0
+    try:
+        # Read again under the lease: the previous holder may have finished
+        current = await schema_version()
+        for number, migration in MIGRATIONS:
+            if number <= current:
+                continue
+            if not await take_migration_lease(owner):
+                raise RuntimeError("Migration lease expired and was taken by another worker")
+            started = time.perf_counter()
+            await migration()
+            await db.metadata.update_one(
+                {"_id": SCHEMA_VERSION_ID},
+                {"$set": {"version": number, "applied_at": datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+            logging.info(f"Applied migration {number} ({migration.__name__}) in {time.perf_counter() - started:.2f}s")
+            applied += 1
+    finally:
+        await db.metadata.delete_one({"_id": MIGRATION_LEASE_ID, "owner": owner})
+    return applied
+
+# Exercise search
+# An in-memory inverted index over the catalog, ranked with BM25. Text is
+# accent-folded and tokenized with Spanish stopwords and plural stripping, so
+# "elevaciones" finds "Elevación". The last query word also matches as a
+# prefix unless the query ends in a space, for type-ahead. The catalog cache
+# syncs the index on every load, re-indexing only exercises whose text changed.
+SEARCH_FIELD_WEIGHTS = {
+    "name": 3.0,
+    "exercise_type": 2.0,
+    "muscle_groups": 2.0,
+    "equipment": 2.0,
+    "description": 1.0,
+    "instructions": 1.0,
+}
+SPANISH_STOPWORDS = frozenset(
+    "a al con de del e el en la las lo los o para por se su sus u un una uno y".split()
+)
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_PREFIX_EXPANSIONS = 50
+MAX_SEARCH_RESULTS = 50
+
+def spanish_stem(token: str):
+    """Strip Spanish plurals: flexiones -> flexion, mancuernas -> mancuerna, veces -> vez."""
+    if len(token) <= 3 or not token.endswith("s"):
+        return token
+    if token.endswith("ces"):
+        return token[:-3] + "z"
+    if token.endswith("es") and token[-3] not in "aeiou":
+        return token[:-2]
+    return token[:-1]
+
+def search_words(text: str):
+    return re.findall(r"[a-z0-9]+", fold_text(text))
+
+def search_terms(text: str):
+    return [spanish_stem(word) for word in search_words(text) if word not in SPANISH_STOPWORDS]
+
+def exercise_search_text(exercise: Exercise):
+    return {
+        "name": exercise.name,
+        "exercise_type": exercise.exercise_type.value.replace("_", " "),
+        "muscle_groups": " ".join(exercise.muscle_groups),
+        "equipment": " ".join(exercise.equipment),
+        "description": exercise.description,
+        "instructions": " ".join(exercise.instructions),
+    }
+
+class SearchIndex:
+    def __init__(self):
+        self.texts: Dict[str, Dict[str, str]] = {}
+        self.names: Dict[str, str] = {}
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.lengths: Dict[str, float] = {}
+        self.total_length = 0.0
+        self.terms = SortedList()
+
+    def add(self, exercise_id: str, texts: Dict[str, str], name: str):
+        frequencies: Dict[str, float] = {}
+        for field, text in texts.items():
+            for term in search_terms(text):
+                frequencies[term] = frequencies.get(term, 0.0) + SEARCH_FIELD_WEIGHTS[field]
+        for term, frequency in frequencies.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                self.terms.add(term)
+            self.postings[term][exercise_id] = frequency
+        self.texts[exercise_id] = texts
+        self.names[exercise_id] = name
+        self.lengths[exercise_id] = sum(frequencies.values())
+        self.total_length += self.lengths[exercise_id]
+
+    def remove(self, exercise_id: str):
+        for term in {term for text in self.texts.pop(exercise_id).values() for term in search_terms(text)}:
+            postings = self.postings[term]
+            postings.pop(exercise_id, None)
+            if not postings:
+                del self.postings[term]
+                self.terms.remove(term)
+        del self.names[exercise_id]
+        self.total_length -= self.lengths.pop(exercise_id)
+
+    def sync(self, exercises: List[Exercise]):
+        """Bring the index in line with the catalog; returns how many exercises were (re)indexed or dropped."""
+        current = {exercise.id: exercise for exercise in exercises}
+        changed = 0
+        for exercise_id in [i for i in self.texts if i not in current]:
+            self.remove(exercise_id)
+            changed += 1
+        for exercise_id, exercise in current.items():
+            texts = exercise_search_text(exercise)
+            if self.texts.get(exercise_id) == texts:
+                continue
+            if exercise_id in self.texts:
+                self.remove(exercise_id)
+            self.add(exercise_id, texts, exercise.name)
+            changed += 1
+        return changed
+
+    def bm25(self, term: str, scores: Dict[str, float]):
+        postings = self.postings[term]
+        count = len(self.lengths)
+        idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+        average_length = self.total_length / count
+        for exercise_id, frequency in postings.items():
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[exercise_id] / average_length)
+            scores[exercise_id] = max(
+                scores.get(exercise_id, 0.0), idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+            )
+
+    def prefix_terms(self, prefix: str):
+        terms = []
+        for term in self.terms.irange(minimum=prefix):
+            if not term.startswith(prefix) or len(terms) >= MAX_PREFIX_EXPANSIONS:
+                break
+            terms.append(term)
+        return terms
+
+    def search(self, query: str, limit: int = 20):
+        """Exercise ids ranked by BM25; ties are broken by name."""
+        words = search_words(query)
+        if not words or not self.lengths:
+            return []
+        prefix = words.pop() if not query[-1].isspace() else None
+        totals: Dict[str, float] = {}
+        query_terms = [[spanish_stem(word)] for word in words if word not in SPANISH_STOPWORDS]
+        if prefix is not None:
+            query_terms.append(sorted({spanish_stem(prefix), *self.prefix_terms(prefix)}))
+        for alternatives in query_terms:
+            # A word scores each exercise once, by its best-matching expansion.
+            scores: Dict[str, float] = {}
+            for term in alternatives:
+                if term in self.postings:
+                    self.bm25(term, scores)
+            for exercise_id, score in scores.items():
+                totals[exercise_id] = totals.get(exercise_id, 0.0) + score
+        ranked = sorted(totals, key=lambda i: (-totals[i], self.names[i]))
+        return ranked[:limit]
+
+# Exercise catalog cache
+# The catalog is small and rarely changes, so it is held in memory and served
+# without a DB round trip. Any write to db.exercises must call
+# bump_catalog_version so every process reloads it.
+CATALOG_VERSION_ID = "exercise_catalog"
+CATALOG_TTL = float(os.environ.get('CATALOG_TTL_SECONDS', '30'))
+
+async def get_catalog_version():
+    stamp = await db.metadata.find_one({"_id": CATALOG_VERSION_ID}, {"version": 1})
+    return stamp["version"] if stamp else 0
+
+async def bump_catalog_version():
+    await db.metadata.update_one({"_id": CATALOG_VERSION_ID}, {"$inc": {"version": 1}}, upsert=True)
+
+class ExerciseCatalog:
+    def __init__(self, ttl: float = CATALOG_TTL):
+        self.ttl = ttl
+        self.version = None
+        self.checked_at = 0.0
+        self.by_id: Dict[str, Exercise] = {}
+        self.by_type: Dict[str, List[Exercise]] = {}
+        self.by_level: Dict[str, List[Exercise]] = {}
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.summaries: Dict[str, Dict[str, Any]] = {}
+        self.encoded_all = b"[]"
+        self.encoded_summaries = b"[]"
+        self.plan_index: Optional["PlanIndex"] = None
+        self.search_index = SearchIndex()
+        self._lock = asyncio.Lock()
+
+    @property
+    def etag(self):
+        return f'"catalog-{self.version}"'
+
+    async def load(self):
+        version = await get_catalog_version()
+        exercises = [Exercise(**from_document(e)) for e in await db.exercises.find().to_list(length=None)]
+        by_type: Dict[str, List[Exercise]] = {}
+        by_level: Dict[str, List[Exercise]] = {}
+        for exercise in exercises:
+            by_type.setdefault(exercise.exercise_type.value, []).append(exercise)
+            by_level.setdefault(exercise.level.value, []).append(exercise)
+        self.by_id = {exercise.id: exercise for exercise in exercises}
+        self.documents = {exercise.id: exercise.dict() for exercise in exercises}
+        self.summaries = {
+            exercise.id: ExerciseSummary(**exercise.dict()).dict() for exercise in exercises
+        }
+        self.encoded_all = dumps_json(list(self.documents.values()))
+        self.encoded_summaries = dumps_json(list(self.summaries.values()))
+        self.by_type = by_type
+        self.by_level = by_level
+        self.plan_index = PlanIndex(exercises)
+        self.search_index.sync(exercises)
+        self.version = version
+        self.checked_at = time.monotonic()
+        logging.info(f"Loaded {len(exercises)} exercises into catalog cache (version {version})")
+
+    async def refresh(self):
+        """Reload if the TTL has expired and the catalog version stamp has changed."""
+        if self.version is not None and time.monotonic() - self.checked_at < self.ttl:
+            return
+        async with self._lock:
+            if self.version is not None and time.monotonic() - self.checked_at < self.ttl:
+                return
+            if self.version is None or await get_catalog_version() != self.version:
+                await self.load()
+            else:
+                self.checked_at = time.monotonic()
+
+    def list(self, exercise_type: Optional[str] = None, level: Optional[str] = None):
+        if exercise_type and level:
+            return [e for e in self.by_type.get(exercise_type, []) if e.level.value == level]
+        if exercise_type:
+            return list(self.by_type.get(exercise_type, []))
+        if level:
+            return list(self.by_level.get(level, []))
+        return list(self.by_id.values())
+
+    def get(self, exercise_id: str):
+        return self.by_id.get(exercise_id)
+
+    def list_documents(self, exercise_type: Optional[str] = None, level: Optional[str] = None,
+                       summary: bool = False):
+        documents = self.summaries if summary else self.documents
+        return [documents[e.id] for e in self.list(exercise_type, level)]
+
+exercise_catalog = ExerciseCatalog()
+
+def etag_matches(if_none_match: Optional[str], etag: str):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    accepted = {etag, f"W/{etag}", *(encoded_etag(etag, encoding) for encoding in COMPRESSORS)}
+    return any(candidate in accepted for candidate in candidates)
+
+# HTTP caching
+# Read routes answer If-None-Match from version stamps alone: the catalog
+# version for exercise data, and for user data a per-user version bumped by
+# every write that changes what the user's read routes return. User stamps
+# are cached in-process for DATA_VERSION_TTL seconds and updated immediately
+# by writes through this process, so a revalidation usually runs no Mongo
+# query. User ETags also carry the UTC day, since stats windows and streaks
+# move with the date.
+CACHE_CONTROL = {
+    "catalog": "public, max-age=300",
+    "user": "private, no-cache",
+    "leaderboard": "private, max-age=30",
+}
+USER_VARY = "Authorization, X-User-Id"
+DATA_VERSION_TTL = float(os.environ.get('DATA_VERSION_TTL_SECONDS', '5'))
+DATA_VERSION_CACHE_SIZE = 10000
+
+class DataVersions:
+    def __init__(self, ttl: float = DATA_VERSION_TTL):
+        self.ttl = ttl
+        # user_id -> (version, updated_at, checked_at)
+        self.versions: Dict[str, tuple] = {}
+
+    def _remember(self, user_id: str, stamp: Optional[Dict[str, Any]]):
+        if user_id not in self.versions and len(self.versions) >= DATA_VERSION_CACHE_SIZE:
+            self.versions.pop(next(iter(self.versions)))
+        stamp = stamp or {}
+        self.versions[user_id] = (stamp.get("version", 0), stamp.get("updated_at"), time.monotonic())
+
+    async def get(self, user_id: str):
+        cached = self.versions.get(user_id)
+        if cached and time.monotonic() - cached[2] < self.ttl:
+            return cached[0]
+        stamp = await db.data_versions.find_one({"_id": user_id})
+        self._remember(user_id, stamp)
+        return self.versions[user_id][0]
+
+    def written_since(self, user_id: str, seconds: float):
+        """Whether the user's last known write happened less than seconds ago."""
+        updated_at = self.versions[user_id][1]
+        return updated_at is not None and datetime.now(timezone.utc) - as_utc(updated_at) < timedelta(seconds=seconds)
+
+    async def bump(self, user_id: str):
+        stamp = await db.data_versions.find_one_and_update(
+            {"_id": user_id},
+            {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self._remember(user_id, stamp)
+        read_cache.invalidate(user_id)
+
+    async def bump_many(self, user_ids: List[str]):
+        if not user_ids:
+            return
+        update = {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+        await db.data_versions.bulk_write([
+            UpdateOne({"_id": user_id}, update, upsert=True) for user_id in user_ids
+        ], ordered=False)
+        for user_id in user_ids:
+            self.versions.pop(user_id, None)
+            read_cache.invalidate(user_id)
+
+    async def bump_all(self):
+        await db.data_versions.update_many(
+            {}, {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+        )
+        self.versions.clear()
+        read_cache.clear()
+
+data_versions = DataVersions()
+
+# Read cache
+# Hot per-user reads go through ReadCache.get: concurrent identical reads
+# (same scope, route and normalized params) share one in-flight load, and
+# results are kept in a bounded LRU for READ_CACHE_TTL seconds. The scope is
+# the user id; DataVersions drops a user's entries on every bump, so writes
+# through this process are visible at once and other workers' writes within
+# the TTL. Cached values are shared between requests and must not be mutated.
+READ_CACHE_TTL = float(os.environ.get('READ_CACHE_TTL_SECONDS', '5'))
+READ_CACHE_SIZE = int(os.environ.get('READ_CACHE_SIZE', '10000'))
+READ_CACHE_COUNTERS = ("hits", "misses", "coalesced", "evictions", "invalidations")
+
+class ReadCache:
+    def __init__(self, ttl: float = READ_CACHE_TTL, max_entries: int = READ_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (scope, route, params) -> (value, expires_at)
+        self.entries: OrderedDict = OrderedDict()
+        self.keys_by_scope: Dict[str, set] = {}
+        self.inflight: Dict[tuple, asyncio.Task] = {}
+        self.counters: Dict[str, Dict[str, int]] = {}
+
+    def count(self, route: str, counter: str, amount: int = 1):
+        counters = self.counters.setdefault(route, dict.fromkeys(READ_CACHE_COUNTERS, 0))
+        counters[counter] += amount
+
+    async def get(self, scope: str, route: str, loader, **params):
+        key = (scope, route, tuple(sorted(params.items())))
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.count(route, "hits")
+            return entry[0]
+        task = self.inflight.get(key)
+        if task is not None:
+            self.count(route, "coalesced")
+        else:
+            self.count(route, "misses")
+            task = asyncio.create_task(self._load(key, loader))
+            self.inflight[key] = task
+        # Shielded so one caller going away does not cancel the others' load
+        return await asyncio.shield(task)
+
+    async def _load(self, key: tuple, loader):
+        try:
+            value = await loader()
+            # Not stored if a write invalidated the key while it was loading
+            if self.inflight.get(key) is asyncio.current_task():
+                self._store(key, value)
+            return value
+        finally:
+            if self.inflight.get(key) is asyncio.current_task():
+                del self.inflight[key]
+
+    def _store(self, key: tuple, value):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        elif len(self.entries) >= self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            self._unindex(evicted)
+            self.count(evicted[1], "evictions")
+        self.entries[key] = (value, time.monotonic() + self.ttl)
+        self.keys_by_scope.setdefault(key[0], set()).add(key)
+
+    def _unindex(self, key: tuple):
+        keys = self.keys_by_scope.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_scope[key[0]]
+
+    def invalidate(self, scope: str):
+        for key in self.keys_by_scope.pop(scope, ()):
+            self.entries.pop(key, None)
+            self.count(key[1], "invalidations")
+        for key in [key for key in self.inflight if key[0] == scope]:
+            del self.inflight[key]
+
+    def clear(self):
+        for key in self.entries:
+            self.count(key[1], "invalidations")
+        self.entries.clear()
+        self.keys_by_scope.clear()
+        self.inflight.clear()
+
+    def snapshot(self):
+        return {"entries": len(self.entries), "inflight": len(self.inflight), "routes": self.counters}
+
+read_cache = ReadCache()
+
+async def load_workout_rollup(user_id: str):
+    reader = await reads_for(user_id)
+    return await reader.workout_stats.find_one({"_id": user_id})
+
+def cached_workout_rollup(user_id: str):
+    return read_cache.get(user_id, "workout_stats", lambda: load_workout_rollup(user_id))
+
+async def reads_for(user_id: str):
+    """Database handle for a user's stats and list reads (see MongoDB connection)."""
+    if read_db is None or MONGO_READ_PREFERENCE == "primary":
+        return db
+    await data_versions.get(user_id)
+    if data_versions.written_since(user_id, SECONDARY_READ_GRACE):
+        return db
+    return read_db
+
+def cache_headers(response: Response, etag: str, policy: str, if_none_match: Optional[str]):
+    """Set the caching headers; returns a 304 response when the client's copy is current."""
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL[policy]}
+    if policy == "user":
+        headers["Vary"] = USER_VARY
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+async def user_cache_headers(response: Response, user_id: str, if_none_match: Optional[str], kind: str, *parts):
+    version = await data_versions.get(user_id)
+    day = datetime.now(timezone.utc).date().isoformat()
+    etag = '"' + "-".join([kind, public_member(user_id), str(version), day, *map(str, parts)]) + '"'
+    return cache_headers(response, etag, "user", if_none_match)
+
+# Workout plan generation
+# PlanIndex is rebuilt with the catalog cache: exercises are bucketed by the
+# lowest fitness level allowed to do them and their equipment is encoded as a
+# bitmask, so checking a user's equipment is a single AND per candidate.
+# Plans pick the least recently done exercises first, round-robin across
+# exercise types (goal-related types first), then add sets until the time
+# budget is used.
+LEVEL_RANKS = {ExerciseLevel.BEGINNER: 0, ExerciseLevel.INTERMEDIATE: 1, ExerciseLevel.ADVANCED: 2}
+DEFAULT_PLAN_MINUTES = 30
+MAX_PLAN_EXERCISES = 8
+MAX_PLAN_SETS = 5
+EQUIPMENT_SYNONYMS = {
+    "mat": "colchoneta",
+    "yoga mat": "colchoneta",
+    "dumbbell": "mancuernas",
+    "dumbbells": "mancuernas",
+    "mancuerna": "mancuernas",
+}
+GOAL_EXERCISE_TYPES = {
+    "lose_weight": [ExerciseType.CARDIO, ExerciseType.FULL_BODY],
+    "improve_endurance": [ExerciseType.CARDIO],
+    "build_muscle": [ExerciseType.PECTORAL, ExerciseType.FULL_BODY],
+    "core": [ExerciseType.ABDOMINAL],
+    "abs": [ExerciseType.ABDOMINAL],
+}
+
+def fold_text(value: str):
+    """Lowercase and strip accents, so "Elevación" matches "elevacion"."""
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower().strip()
+
+def equipment_key(name: str):
+    key = fold_text(name)
+    return EQUIPMENT_SYNONYMS.get(key, key)
+
+class PlanIndex:
+    def __init__(self, exercises: List[Exercise]):
+        vocabulary = sorted({equipment_key(item) for e in exercises for item in e.equipment})
+        self.equipment_bits = {name: 1 << i for i, name in enumerate(vocabulary)}
+        self.all_equipment = (1 << len(vocabulary)) - 1
+        self.eligible: Dict[int, Dict[ExerciseType, List[tuple]]] = {}
+        for rank in LEVEL_RANKS.values():
+            by_type: Dict[ExerciseType, List[tuple]] = {}
+            for exercise in exercises:
+                if LEVEL_RANKS[exercise.level] <= rank:
+                    by_type.setdefault(exercise.exercise_type, []).append(
+                        (self.equipment_mask(exercise.equipment), exercise)
+                    )
+            self.eligible[rank] = by_type
+
+    def equipment_mask(self, equipment: List[str]):
+        mask = 0
+        for item in equipment:
+            mask |= self.equipment_bits.get(equipment_key(item), 0)
+        return mask
+
+    def candidates(self, level: ExerciseLevel, equipment: Optional[List[str]]):
+        # An empty equipment list means the user hasn't said, not that they have nothing
+        available = self.equipment_mask(equipment) if equipment else self.all_equipment
+        return {
+            exercise_type: [exercise for mask, exercise in entries if not mask & ~available]
+            for exercise_type, entries in self.eligible[LEVEL_RANKS[level]].items()
+        }
+
+def generate_plan(index: PlanIndex, level: ExerciseLevel, equipment: Optional[List[str]],
+                  duration_minutes: int, goals: List[str], exercise_types: Optional[List[ExerciseType]],
+                  last_performed: Dict[str, datetime]):
+    budget = duration_minutes * 60
+    pools = {
+        # Never-done exercises first, then the least recently done
+        exercise_type: sorted(pool, key=lambda e: (e.id in last_performed, last_performed.get(e.id), e.name))
+        for exercise_type, pool in index.candidates(level, equipment).items()
+        if not exercise_types or exercise_type in exercise_types
+    }
+    preferred = [t for goal in goals for t in GOAL_EXERCISE_TYPES.get(goal, []) if t in pools]
+    type_order = list(dict.fromkeys(preferred + sorted(pools, key=lambda t: t.value)))
+
+    selected: List[List[Any]] = []
+    remaining = budget
+    added = True
+    while added and len(selected) < MAX_PLAN_EXERCISES:
+        added = False
+        for exercise_type in type_order:
+            pool = pools[exercise_type]
+            while pool and len(selected) < MAX_PLAN_EXERCISES:
+                exercise = pool.pop(0)
+                set_seconds = exercise.default_duration + exercise.default_rest
+                if set_seconds <= remaining:
+                    selected.append([exercise, 1])
+                    remaining -= set_seconds
+                    added = True
+                    break
+
+    grown = True
+    while grown:
+        grown = False
+        for item in selected:
+            exercise, sets = item
+            set_seconds = exercise.default_duration + exercise.default_rest
+            if sets < MAX_PLAN_SETS and set_seconds <= remaining:
+                item[1] += 1
+                remaining -= set_seconds
+                grown = True
+
+    items = [
+        PlanItem(
+            exercise_id=exercise.id,
+            name=exercise.name,
+            exercise_type=exercise.exercise_type,
+            sets=sets,
+            work_seconds=exercise.default_duration,
+            rest_seconds=exercise.default_rest,
+            repetitions=exercise.default_repetitions,
+            duration=(exercise.default_duration + exercise.default_rest) * sets,
+        )
+        for exercise, sets in selected
+    ]
+    return WorkoutPlan(
+        fitness_level=level,
+        duration_budget=budget,
+        total_duration=budget - remaining,
+        items=items,
+    )
+
+PLAN_PROFILE_PROJECTION = {"_id": 0, "fitness_level": 1, "available_equipment": 1, "preferred_duration": 1, "goals": 1}
+
+def plan_for_profile(profile: Dict[str, Any], plan_request: PlanRequest, last_performed: Dict[str, datetime]):
+    return generate_plan(
+        exercise_catalog.plan_index,
+        level=plan_request.fitness_level or profile.get("fitness_level") or ExerciseLevel.BEGINNER,
+        equipment=plan_request.available_equipment if plan_request.available_equipment is not None
+        else profile.get("available_equipment"),
+        duration_minutes=plan_request.duration or profile.get("preferred_duration") or DEFAULT_PLAN_MINUTES,
+        goals=plan_request.goals if plan_request.goals is not None else profile.get("goals") or [],
+        exercise_types=plan_request.exercise_types,
+        last_performed=last_performed,
+    )
+
+async def generate_all_plans(batch_size: int = 1000):
+    """Nightly batch: generate and store a plan for every profile."""
+    await exercise_catalog.refresh()
+    last_performed: Dict[str, Dict[str, datetime]] = {}
+    async for stats in db.exercise_stats.find({}, {"_id": 0, "user_id": 1, "exercise_id": 1, "last_performed": 1}):
+        last_performed.setdefault(stats["user_id"], {})[stats["exercise_id"]] = stats["last_performed"]
+
+    generated = 0
+    plans: Dict[str, WorkoutPlan] = {}
+
+    async def store(plans):
+        await db.workout_plans.bulk_write([
+            ReplaceOne({"user_id": user_id}, {**prepare_for_mongo(plan.dict()), "user_id": user_id}, upsert=True)
+            for user_id, plan in plans.items()
+        ], ordered=False)
+        await data_versions.bump_many(list(plans))
+        return len(plans)
+
+    cursor = db.user_profiles.find({}, {**PLAN_PROFILE_PROJECTION, "user_id": 1}).batch_size(batch_size)
+    async for profile in cursor:
+        user_id = profile["user_id"]
+        plans[user_id] = plan_for_profile(profile, PlanRequest(), last_performed.get(user_id, {}))
+        if len(plans) >= batch_size:
+            generated += await store(plans)
+            plans = {}
+    if plans:
+        generated += await store(plans)
+    logging.info(f"Generated workout plans for {generated} users")
+    return generated
 
 # Routes
 @api_router.get("/")
@@ -207,107 +3011,442 @@ async def root():
     return {"message": "Fitness App API - ¡Entrena con éxito!"}
 
 # Exercise routes
-@api_router.get("/exercises", response_model=List[Exercise])
-async def get_exercises(exercise_type: Optional[str] = None, level: Optional[str] = None):
-    filter_query = {}
-    if exercise_type:
-        filter_query["exercise_type"] = exercise_type
-    if level:
-        filter_query["level"] = level
-    
-    exercises = await db.exercises.find(filter_query).to_list(length=None)
-    return [Exercise(**exercise) for exercise in exercises]
+EXERCISE_VIEWS = ("full", "summary")
+
+@api_router.get("/exercises", response_model=Union[List[Exercise], List[ExerciseSummary]])
+async def get_exercises(
+    response: Response,
+    exercise_type: Optional[str] = None,
+    level: Optional[str] = None,
+    view: str = "full",
+    if_none_match: Optional[str] = Header(None),
+):
+    if view not in EXERCISE_VIEWS:
+        raise HTTPException(status_code=400, detail=f"view must be one of {', '.join(EXERCISE_VIEWS)}")
+    await exercise_catalog.refresh()
+    not_modified = cache_headers(response, exercise_catalog.etag, "catalog", if_none_match)
+    if not_modified:
+        return not_modified
+    summary = view == "summary"
+    if STRICT_RESPONSES:
+        exercises = exercise_catalog.list(exercise_type, level)
+        return [ExerciseSummary(**e.dict()) for e in exercises] if summary else exercises
+    if not exercise_type and not level:
+        encoded = exercise_catalog.encoded_summaries if summary else exercise_catalog.encoded_all
+        return json_response(None, response, encoded=encoded)
+    return json_response(exercise_catalog.list_documents(exercise_type, level, summary), response)
+
+@api_router.get("/exercises/search", response_model=List[ExerciseSummary])
+async def search_exercises(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS),
+    if_none_match: Optional[str] = Header(None),
+):
+    await exercise_catalog.refresh()
+    not_modified = cache_headers(response, exercise_catalog.etag, "catalog", if_none_match)
+    if not_modified:
+        return not_modified
+    exercise_ids = exercise_catalog.search_index.search(q, limit)
+    if STRICT_RESPONSES:
+        return [ExerciseSummary(**exercise_catalog.get(i).dict()) for i in exercise_ids]
+    return json_response([exercise_catalog.summaries[i] for i in exercise_ids], response)
 
 @api_router.get("/exercises/{exercise_id}", response_model=Exercise)
-async def get_exercise(exercise_id: str):
-    exercise = await db.exercises.find_one({"id": exercise_id})
+async def get_exercise(
+    exercise_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+):
+    await exercise_catalog.refresh()
+    exercise = exercise_catalog.get(exercise_id)
     if not exercise:
         raise HTTPException(status_code=404, detail="Exercise not found")
-    return Exercise(**exercise)
+    not_modified = cache_headers(response, exercise_catalog.etag, "catalog", if_none_match)
+    if not_modified:
+        return not_modified
+    if STRICT_RESPONSES:
+        return exercise
+    return json_response(exercise_catalog.documents[exercise_id], response)
+
+@api_router.get("/exercises/{exercise_id}/stats", response_model=ExerciseStats)
+async def get_exercise_stats(
+    exercise_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_user_id),
+):
+    not_modified = await user_cache_headers(response, user_id, if_none_match, "exercise-stats")
+    if not_modified:
+        return not_modified
+    async def load_stats():
+        reader = await reads_for(user_id)
+        return await reader.exercise_stats.find_one(
+            {"user_id": user_id, "exercise_id": exercise_id}, {"_id": 0, "user_id": 0, "exercise_id": 0}
+        )
+
+    stats = await read_cache.get(user_id, "exercise_stats", load_stats, exercise_id=exercise_id)
+    if not stats:
+        await exercise_catalog.refresh()
+        if not exercise_catalog.get(exercise_id):
+            raise HTTPException(status_code=404, detail="Exercise not found")
+        return ExerciseStats(exercise_id=exercise_id)
+    return ExerciseStats(exercise_id=exercise_id, **stats)
+
+# Dashboard: catalog and stats in one round trip
+@api_router.get("/dashboard", response_model=Dashboard)
+async def get_dashboard(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_user_id),
+):
+    await exercise_catalog.refresh()
+    not_modified = await user_cache_headers(
+        response, user_id, if_none_match, "dashboard", f"catalog{exercise_catalog.version}"
+    )
+    if not_modified:
+        return not_modified
+    stats = summarize_workout_stats(await cached_workout_rollup(user_id))
+    if STRICT_RESPONSES:
+        return Dashboard(exercises=exercise_catalog.list(), stats=stats)
+    return json_response({"exercises": exercise_catalog.list_documents(), "stats": stats}, response)
 
 # Workout session routes
-@api_router.post("/workouts", response_model=WorkoutSession)
-async def create_workout_session(workout: WorkoutSession):
-    workout_dict = prepare_for_mongo(workout.dict())
-    await db.workout_sessions.insert_one(workout_dict)
-    return workout
+@api_router.post("/workouts", response_model=WorkoutSessionWithStats)
+async def create_workout_session(workout: WorkoutSession, user_id: str = Depends(get_user_id)):
+    workout_dict = to_document(workout, user_id)
+    if write_behind.running:
+        await write_behind.put(user_id, workout, workout_dict)
+        rollup = await cached_workout_rollup(user_id)
+        return WorkoutSessionWithStats(**workout.dict(), stats=summarize_workout_stats(rollup, [workout]))
+    workout_dict[UNAPPLIED_FIELD] = True
+    try:
+        await db.workout_sessions.insert_one((await stamp_sequences([workout_dict]))[0])
+    except DuplicateKeyError:
+        # A retry: answer with the stored session, applying it if the first attempt did not
+        existing = await db.workout_sessions.find_one(
+            {"_id": workout.id}, {**SESSION_PROJECTION, "user_id": 1, UNAPPLIED_FIELD: 1}
+        )
+        if existing is None or existing.get("user_id") != user_id:
+            raise HTTPException(status_code=409, detail="Workout session id already exists")
+        workout = stored_record(WorkoutSession, existing)
+        if existing.get(UNAPPLIED_FIELD) and await claim_unapplied(db.workout_sessions, workout.id, user_id):
+            rollup = await record_sessions_written(user_id, [workout])
+        else:
+            rollup = await cached_workout_rollup(user_id)
+        return WorkoutSessionWithStats(**workout.dict(), stats=summarize_workout_stats(rollup))
+    rollup = await record_sessions_written(user_id, [workout])
+    await mark_applied(db.workout_sessions, [workout])
+    # Return the updated stats so clients don't need a follow-up /workouts/stats
+    return WorkoutSessionWithStats(**workout.dict(), stats=summarize_workout_stats(rollup))
+
+@api_router.post("/workouts/bulk", response_model=BulkResult)
+async def create_workout_sessions_bulk(request: Request, user_id: str = Depends(get_user_id)):
+    items = await read_bulk_body(request)
+    result, created = await ingest_bulk(db.workout_sessions, WorkoutSession, items, user_id, track_applied=True)
+    await record_sessions_written(user_id, created)
+    await mark_applied(db.workout_sessions, created)
+    return result
+
+@api_router.get("/workouts/export")
+async def export_workout_sessions(
+    format: str = "ndjson",
+    gzip: bool = False,
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    user_id: str = Depends(get_user_id),
+):
+    reader = await reads_for(user_id)
+    return export_response(reader.workout_sessions, user_id, "workouts", format, gzip, from_date, to_date)
+
+@api_router.get("/workouts/write-behind")
+async def get_write_behind_metrics():
+    return {"enabled": write_behind.running, **write_behind.snapshot()}
 
 @api_router.get("/workouts", response_model=List[WorkoutSession])
-async def get_workout_sessions(limit: int = 50):
-    sessions = await db.workout_sessions.find().sort("created_at", -1).limit(limit).to_list(length=None)
+async def get_workout_sessions(
+    response: Response,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_user_id),
+):
+    not_modified = await user_cache_headers(response, user_id, if_none_match, "workouts")
+    if not_modified:
+        return not_modified
+    reader = await reads_for(user_id)
+    sessions = await fetch_page(
+        reader.workout_sessions, response, user_id, limit, SESSION_PROJECTION, cursor, from_date, to_date
+    )
+    if not STRICT_RESPONSES:
+        return json_response(sessions, response)
     return [WorkoutSession(**session) for session in sessions]
 
 @api_router.get("/workouts/stats")
-async def get_workout_stats():
-    total_sessions = await db.workout_sessions.count_documents({})
-    
-    # Get sessions from last 30 days
-    from datetime import timedelta
-    thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
-    recent_sessions = await db.workout_sessions.count_documents({
-        "created_at": {"$gte": thirty_days_ago.isoformat()}
-    })
-    
-    # Calculate total workout time
-    pipeline = [
-        {"$group": {"_id": None, "total_time": {"$sum": "$total_duration"}}}
-    ]
-    total_time_result = await db.workout_sessions.aggregate(pipeline).to_list(length=1)
-    total_time = total_time_result[0]["total_time"] if total_time_result else 0
-    
-    return {
-        "total_sessions": total_sessions,
-        "recent_sessions": recent_sessions,
-        "total_workout_time": total_time,
-        "average_session_time": total_time // total_sessions if total_sessions > 0 else 0
-    }
+async def get_workout_stats(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_user_id),
+):
+    not_modified = await user_cache_headers(response, user_id, if_none_match, "workout-stats")
+    if not_modified:
+        return not_modified
+    return summarize_workout_stats(await cached_workout_rollup(user_id))
+
+@api_router.get("/trends")
+async def get_trends(
+    response: Response,
+    granularity: str = "week",
+    window: int = Query(4, ge=1, le=52),
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_user_id),
+):
+    if granularity not in TREND_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(TREND_GRANULARITIES)}")
+    not_modified = await user_cache_headers(response, user_id, if_none_match, "trends")
+    if not_modified:
+        return not_modified
+    today = datetime.now(timezone.utc).date()
+    # The data version covers writes made by other workers
+    key = (
+        user_id,
+        await data_versions.get(user_id),
+        as_utc(from_date) if from_date else None,
+        as_utc(to_date) if to_date else None,
+        granularity,
+        window,
+        today,
+    )
+    trends = trends_cache.get(key)
+    if trends is None:
+        reader = await reads_for(user_id)
+        sessions, measurements = await load_trend_columns(user_id, from_date, to_date, reader)
+        trends = compute_trends(sessions, measurements, granularity, window, today)
+        cache_result(trends_cache, key, trends)
+    return trends
+
+@api_router.get("/series/{metric}")
+async def get_series(
+    metric: str,
+    response: Response,
+    points: int = Query(DEFAULT_SERIES_POINTS, ge=3, le=MAX_SERIES_POINTS),
+    method: str = "lttb",
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_user_id),
+):
+    if metric not in SERIES_METRICS:
+        raise HTTPException(status_code=404, detail="Series not found")
+    if method not in SERIES_METHODS:
+        raise HTTPException(status_code=400, detail=f"method must be one of {', '.join(SERIES_METHODS)}")
+    not_modified = await user_cache_headers(response, user_id, if_none_match, "series")
+    if not_modified:
+        return not_modified
+    key = (
+        user_id,
+        await data_versions.get(user_id),
+        metric,
+        as_utc(from_date) if from_date else None,
+        as_utc(to_date) if to_date else None,
+        points,
+        method,
+    )
+    series = series_cache.get(key)
+    if series is None:
+        reader = await reads_for(user_id)
+        created_at, values = await load_series_column(user_id, metric, from_date, to_date, reader)
+        series = compute_series(metric, created_at, values, points, method)
+        cache_result(series_cache, key, series)
+    return series
 
 # User profile routes
 @api_router.post("/profile", response_model=UserProfile)
-async def create_or_update_profile(profile: UserProfile):
-    # For simplicity, we'll use a single profile. In real app, you'd use user authentication
-    existing_profile = await db.user_profiles.find_one({})
-    
-    if existing_profile:
-        profile.id = existing_profile["id"]
-        profile.created_at = datetime.fromisoformat(existing_profile["created_at"])
-        profile.updated_at = datetime.now(timezone.utc)
-        
-        await db.user_profiles.replace_one(
-            {"id": profile.id}, 
-            prepare_for_mongo(profile.dict())
-        )
-    else:
-        await db.user_profiles.insert_one(prepare_for_mongo(profile.dict()))
-    
-    return profile
+async def create_or_update_profile(profile: UserProfile, user_id: str = Depends(get_user_id)):
+    # One atomic upsert: id and created_at are only written on first insert
+    fields = to_document(profile)
+    fields["updated_at"] = datetime.now(timezone.utc)
+    await stamp_sequences([fields])
+    on_insert = {key: fields.pop(key) for key in ("_id", "created_at")}
+    on_insert["created_seq"] = fields["seq"]
+    stored = await db.user_profiles.find_one_and_update(
+        {"user_id": user_id},
+        {"$set": fields, "$setOnInsert": on_insert},
+        projection=PROFILE_PROJECTION,
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    await data_versions.bump(user_id)
+    return UserProfile(**from_document(stored))
 
 @api_router.get("/profile", response_model=Optional[UserProfile])
-async def get_profile():
-    profile = await db.user_profiles.find_one({})
-    return UserProfile(**profile) if profile else None
+async def get_profile(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_user_id),
+):
+    not_modified = await user_cache_headers(response, user_id, if_none_match, "profile")
+    if not_modified:
+        return not_modified
+    async def load_profile():
+        profile = await db.user_profiles.find_one({"user_id": user_id}, PROFILE_PROJECTION)
+        return UserProfile(**from_document(profile)) if profile else None
+
+    return await read_cache.get(user_id, "profile", load_profile)
+
+# Workout plan routes
+@api_router.post("/plans/generate", response_model=WorkoutPlan)
+async def generate_workout_plan(plan_request: Optional[PlanRequest] = None, user_id: str = Depends(get_user_id)):
+    profile, stats, _ = await asyncio.gather(
+        db.user_profiles.find_one({"user_id": user_id}, PLAN_PROFILE_PROJECTION),
+        db.exercise_stats.find({"user_id": user_id}, {"_id": 0, "exercise_id": 1, "last_performed": 1}).to_list(length=None),
+        exercise_catalog.refresh(),
+    )
+    last_performed = {s["exercise_id"]: s["last_performed"] for s in stats}
+    return plan_for_profile(profile or {}, plan_request or PlanRequest(), last_performed)
+
+@api_router.get("/plans/current", response_model=Optional[WorkoutPlan])
+async def get_current_plan(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_user_id),
+):
+    not_modified = await user_cache_headers(response, user_id, if_none_match, "plan")
+    if not_modified:
+        return not_modified
+    async def load_plan():
+        plan = await db.workout_plans.find_one({"user_id": user_id}, USER_DOC_PROJECTION)
+        return WorkoutPlan(**plan) if plan else None
+
+    return await read_cache.get(user_id, "current_plan", load_plan)
+
+# Leaderboard routes
+@api_router.get("/leaderboards/{kind}", response_model=Leaderboard)
+async def get_leaderboard(
+    kind: str,
+    response: Response,
+    limit: int = Query(10, ge=1, le=MAX_LEADERBOARD_SIZE),
+    user_id: str = Depends(get_user_id),
+):
+    if kind not in LEADERBOARD_KINDS:
+        raise HTTPException(status_code=404, detail="Leaderboard not found")
+    await asyncio.gather(leaderboards.refresh(), exercise_catalog.refresh())
+    response.headers["Cache-Control"] = CACHE_CONTROL["leaderboard"]
+    return leaderboards.leaderboard(kind, limit, user_id)
+
+# Delta sync routes
+@api_router.get("/sync")
+async def sync_changes(
+    response: Response,
+    since: int = Query(0, ge=0),
+    limit: int = Query(DEFAULT_SYNC_LIMIT, ge=1, le=MAX_SYNC_LIMIT),
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_user_id),
+):
+    await exercise_catalog.refresh()
+    not_modified = await user_cache_headers(
+        response, user_id, if_none_match, "sync", since, limit, exercise_catalog.version
+    )
+    if not_modified:
+        return not_modified
+    reader = await reads_for(user_id)
+    loaded = await asyncio.gather(*(
+        load_changes(reader, collection_name, projection, user_id, since, limit)
+        for collection_name, projection in SYNC_COLLECTIONS.values()
+    ))
+    return json_response(sync_response(dict(zip(SYNC_COLLECTIONS, loaded)), since, limit), response)
 
 # Measurements routes
 @api_router.post("/measurements", response_model=AbdominalMeasurement)
-async def add_measurement(measurement: AbdominalMeasurement):
-    measurement_dict = prepare_for_mongo(measurement.dict())
-    await db.measurements.insert_one(measurement_dict)
+async def add_measurement(measurement: AbdominalMeasurement, user_id: str = Depends(get_user_id)):
+    try:
+        await db.measurements.insert_one((await stamp_sequences([to_document(measurement, user_id)]))[0])
+    except DuplicateKeyError:
+        existing = await db.measurements.find_one({"_id": measurement.id}, {**MEASUREMENT_PROJECTION, "user_id": 1})
+        if existing is None or existing.get("user_id") != user_id:
+            raise HTTPException(status_code=409, detail="Measurement id already exists")
+        measurement = stored_record(AbdominalMeasurement, existing)
+    invalidate_trends(user_id)
+    await data_versions.bump(user_id)
     return measurement
 
+@api_router.post("/measurements/bulk", response_model=BulkResult)
+async def add_measurements_bulk(request: Request, user_id: str = Depends(get_user_id)):
+    items = await read_bulk_body(request)
+    result, created = await ingest_bulk(db.measurements, AbdominalMeasurement, items, user_id)
+    # Duplicates too: the attempt that stored them may have died before this
+    if created or result.duplicates:
+        invalidate_trends(user_id)
+        await data_versions.bump(user_id)
+    return result
+
+@api_router.get("/measurements/export")
+async def export_measurements(
+    format: str = "ndjson",
+    gzip: bool = False,
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    user_id: str = Depends(get_user_id),
+):
+    reader = await reads_for(user_id)
+    return export_response(reader.measurements, user_id, "measurements", format, gzip, from_date, to_date)
+
 @api_router.get("/measurements", response_model=List[AbdominalMeasurement])
-async def get_measurements(limit: int = 50):
-    measurements = await db.measurements.find().sort("created_at", -1).limit(limit).to_list(length=None)
+async def get_measurements(
+    response: Response,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_user_id),
+):
+    not_modified = await user_cache_headers(response, user_id, if_none_match, "measurements")
+    if not_modified:
+        return not_modified
+    reader = await reads_for(user_id)
+    measurements = await fetch_page(
+        reader.measurements, response, user_id, limit, MEASUREMENT_PROJECTION, cursor, from_date, to_date
+    )
+    if not STRICT_RESPONSES:
+        return json_response(measurements, response)
     return [AbdominalMeasurement(**measurement) for measurement in measurements]
 
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for key, value in write_behind.snapshot().items():
+        lines.append(f"# TYPE fitness_write_behind_{key} gauge")
+        lines.append(f"fitness_write_behind_{key} {value}")
+    cache = read_cache.snapshot()
+    for key in ("entries", "inflight"):
+        lines.append(f"# TYPE fitness_read_cache_{key} gauge")
+        lines.append(f"fitness_read_cache_{key} {cache[key]}")
+    for counter in READ_CACHE_COUNTERS:
+        lines.append(f"# TYPE fitness_read_cache_{counter}_total counter")
+        for route, counters in sorted(cache["routes"].items()):
+            lines.append(f'fitness_read_cache_{counter}_total{{route="{route}"}} {counters[counter]}')
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
 # Configure logging
@@ -319,9 +3458,22 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("startup")
 async def startup_event():
-    await initialize_exercises()
-    logger.info("Fitness App started successfully!")
+    started = time.perf_counter()
+    if db is None:
+        connect_mongo()
+    await run_migrations()
+    await ensure_indexes()
+    if os.environ.get('VERIFY_QUERY_PLANS', '').lower() in ('1', 'true', 'yes'):
+        await verify_query_plans()
+    await apply_exercise_catalog()
+    await exercise_catalog.load()
+    await ensure_workout_stats()
+    await leaderboards.load()
+    if WRITE_BEHIND:
+        await write_behind.start()
+    logger.info(f"Fitness App started successfully in {time.perf_counter() - started:.2f}s!")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    await write_behind.stop()
+    close_mongo()
@@ -74,11 +74,26 @@ def test_exercises_api():
                 if detail_response.status_code == 200:
                     exercise_detail = detail_response.json()
                     print(f"✅ Exercise detail: {exercise_detail['name']}")
-                    return True
                 else:
                     print(f"❌ Failed to get exercise detail: {detail_response.text}")
                     return False
             
+            # Test GET /exercises/search ignores accents and matches prefixes
+            print("\nTesting GET /exercises/search...")
+            for query, expected in [("elevacion", "Elevación de piernas y crunch abdominal"),
+                                    ("mancu", "Peso muerto con mancuernas")]:
+                search_response = requests.get(f"{BACKEND_URL}/exercises/search", params={"q": query})
+                print(f"Status: {search_response.status_code}")
+                if search_response.status_code != 200:
+                    print(f"❌ Failed to search exercises: {search_response.text}")
+                    return False
+                results = [ex['name'] for ex in search_response.json()]
+                if not results or results[0] != expected:
+                    print(f"❌ Search for '{query}' returned {results}")
+                    return False
+                print(f"✅ '{query}' -> {results[0]}")
+            return True
+            
         else:
             print(f"❌ Failed to get exercises: {response.text}")
             return False
@@ -289,6 +304,93 @@ def test_measurements_api():
         print(f"❌ Error testing measurements: {e}")
         return False
 
+def test_bulk_ingestion_api():
+    """Test bulk workout and measurement ingestion endpoints"""
+    print("\n📦 Testing Bulk Ingestion API...")
+    
+    # Test POST /workouts/bulk - Sync a batch of sessions twice
+    print("Testing POST /workouts/bulk...")
+    try:
+        workouts = [
+            {
+                "id": str(uuid.uuid4()),
+                "date": datetime.now(timezone.utc).isoformat(),
+                "exercises_completed": [
+                    {"exercise_id": "test-exercise-1", "exercise_name": "Push-up", "duration": 30}
+                ],
+                "total_duration": 180 + i * 60,
+                "difficulty_rating": 3
+            }
+            for i in range(3)
+        ]
+        
+        response = requests.post(f"{BACKEND_URL}/workouts/bulk", json=workouts)
+        print(f"Status: {response.status_code}")
+        
+        if response.status_code != 200 or response.json()['created'] != 3:
+            print(f"❌ Failed to bulk create workouts: {response.text}")
+            return False
+        print(f"✅ Bulk created {response.json()['created']} workout sessions")
+        
+        # Retrying the same batch must not create duplicates
+        response = requests.post(f"{BACKEND_URL}/workouts/bulk", json=workouts)
+        result = response.json()
+        if result['created'] != 0 or result['duplicates'] != 3:
+            print(f"❌ Retried batch was not idempotent: {result}")
+            return False
+        print("✅ Retried batch reported as duplicates")
+        
+        # Test POST /measurements/bulk with an NDJSON body
+        print("\nTesting POST /measurements/bulk (NDJSON)...")
+        measurements = [
+            {"measurement": 86.0 - i * 0.5, "date": datetime.now(timezone.utc).isoformat()}
+            for i in range(2)
+        ]
+        response = requests.post(
+            f"{BACKEND_URL}/measurements/bulk",
+            data="\n".join(json.dumps(m) for m in measurements),
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+        print(f"Status: {response.status_code}")
+        
+        if response.status_code == 200 and response.json()['created'] == 2:
+            print("✅ Bulk created 2 measurements")
+            return True
+        else:
+            print(f"❌ Failed to bulk create measurements: {response.text}")
+            return False
+            
+    except Exception as e:
+        print(f"❌ Error testing bulk ingestion: {e}")
+        return False
+
+def test_dashboard_api():
+    """Test the combined dashboard endpoint"""
+    print("\n📊 Testing Dashboard API...")
+    
+    print("Testing GET /dashboard...")
+    try:
+        response = requests.get(f"{BACKEND_URL}/dashboard")
+        print(f"Status: {response.status_code}")
+        
+        if response.status_code == 200:
+            dashboard = response.json()
+            if len(dashboard.get('exercises', [])) < 5:
+                print(f"❌ Expected the exercise catalog, got {len(dashboard.get('exercises', []))} exercises")
+                return False
+            if 'total_sessions' not in dashboard.get('stats', {}):
+                print(f"❌ Missing stats in dashboard: {dashboard.get('stats')}")
+                return False
+            print(f"✅ Dashboard: {len(dashboard['exercises'])} exercises, stats {dashboard['stats']}")
+            return True
+        else:
+            print(f"❌ Failed to get dashboard: {response.text}")
+            return False
+            
+    except Exception as e:
+        print(f"❌ Error testing dashboard: {e}")
+        return False
+
 def run_all_tests():
     """Run all backend API tests"""
     print("🚀 Starting Fitness App Backend API Tests")
@@ -299,7 +401,9 @@ def run_all_tests():
         "Exercise API": test_exercises_api(),
         "Workout Sessions API": test_workout_sessions_api(),
         "User Profile API": test_user_profile_api(),
-        "Measurements API": test_measurements_api()
+        "Measurements API": test_measurements_api(),
+        "Bulk Ingestion API": test_bulk_ingestion_api(),
+        "Dashboard API": test_dashboard_api()
     }
     
     print("\n" + "=" * 50)
@@ -316,30 +316,21 @@ const App = () => {
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
-    fetchExercises();
-    fetchWorkoutStats();
+    fetchDashboard();
   }, []);
 
-  const fetchExercises = async () => {
+  const fetchDashboard = async () => {
     try {
-      const response = await axios.get(`${API}/exercises`);
-      setExercises(response.data);
+      const response = await axios.get(`${API}/dashboard`);
+      setExercises(response.data.exercises);
+      setWorkoutStats(response.data.stats);
     } catch (error) {
-      console.error('Error fetching exercises:', error);
+      console.error('Error fetching dashboard:', error);
     } finally {
       setLoading(false);
     }
   };
 
-  const fetchWorkoutStats = async () => {
-    try {
-      const response = await axios.get(`${API}/workouts/stats`);
-      setWorkoutStats(response.data);
-    } catch (error) {
-      console.error('Error fetching stats:', error);
-    }
-  };
-
   const handleExerciseSelect = (exercise) => {
     setSelectedExercise(exercise);
     setShowModal(true);
@@ -361,9 +352,9 @@ const App = () => {
         notes: null
       };
       
-      await axios.post(`${API}/workouts`, sessionData);
+      const response = await axios.post(`${API}/workouts`, sessionData);
       setActiveTimer(null);
-      fetchWorkoutStats();
+      setWorkoutStats(response.data.stats);
       
       // Show completion message
       alert('¡Felicidades! Has completado el ejercicio. 🎉');
@@ -0,0 +1,44 @@
+import os
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "fitness_test")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A fresh in-memory database, with every process-local cache reset."""
+    database = AsyncMongoMockClient(tz_aware=True)["fitness_test"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "data_versions", server.DataVersions())
+    monkeypatch.setattr(server, "read_cache", server.ReadCache())
+    monkeypatch.setattr(server, "exercise_catalog", server.ExerciseCatalog())
+    monkeypatch.setattr(server, "leaderboards", server.Leaderboards())
+    monkeypatch.setattr(server, "snapshot_store", None)
+    server.trends_cache.clear()
+    server.series_cache.clear()
+    return database
+
+
+@pytest.fixture
+async def api(db):
+    await server.run_migrations()
+    await server.ensure_indexes()
+    await server.apply_exercise_catalog()
+    await server.exercise_catalog.load()
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def shipped_catalog():
+    return server.load_catalog_file()
+
+
+def write_catalog(tmp_path, data):
+    path = tmp_path / "exercise_catalog.json"
+    path.write_text(json.dumps(data))
+    return path
+
+
+async def test_fresh_database_is_seeded_once(db):
+    assert await server.run_migrations() == len(server.MIGRATIONS)
+    await server.ensure_indexes()
+    assert await server.apply_exercise_catalog() == 5
+
+    exercises = await db.exercises.find({}).to_list(length=None)
+    assert {exercise["_id"] for exercise in exercises} == {
+        server.catalog_exercise_id(entry["slug"]) for entry in shipped_catalog()["exercises"]
+    }
+    assert all(exercise["created_seq"] == exercise["seq"] for exercise in exercises)
+
+    assert await server.apply_exercise_catalog() == 0
+    assert await server.run_migrations() == 0
+
+
+async def test_new_catalog_version_upserts_only_changed_entries(api, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "SYNC_SETTLE", 0)
+    token = (await api.get("/api/sync")).json()["token"]
+
+    data = shipped_catalog()
+    data["version"] += 1
+    data["exercises"][0]["default_rest"] = 45
+    removed = data["exercises"].pop()
+    data["exercises"].append({**data["exercises"][1], "slug": "plancha", "name": "Plancha"})
+    assert await server.apply_exercise_catalog(write_catalog(tmp_path, data)) == 2
+
+    changes = (await api.get("/api/sync", params={"since": token})).json()["changes"]["exercises"]
+    assert [exercise["slug"] for exercise in changes["updated"]] == [data["exercises"][0]["slug"]]
+    assert [exercise["slug"] for exercise in changes["inserted"]] == ["plancha"]
+    assert changes["updated"][0]["default_rest"] == 45
+    # Entries dropped from the file stay, since workout history refers to them
+    assert await server.db.exercises.count_documents({"slug": removed["slug"]}) == 1
+
+    assert await server.apply_exercise_catalog(write_catalog(tmp_path, data)) == 0
+
+
+async def test_exercises_seeded_before_the_catalog_file_keep_their_ids(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "SYNC_SETTLE", 0)
+    legacy_ids = {}
+    for number, entry in enumerate(shipped_catalog()["exercises"], start=1):
+        document = server.to_document(server.Exercise(**entry))
+        del document["slug"]
+        legacy_ids[entry["slug"]] = document["_id"]
+        await db.exercises.insert_one({**document, "seq": number})
+    await db.metadata.insert_one({"_id": server.SYNC_SEQUENCE_ID, "seq": 5})
+
+    await server.run_migrations()
+    await server.ensure_indexes()
+    assert await server.apply_exercise_catalog() == 0
+    exercises = await db.exercises.find({}).to_list(length=None)
+    assert {exercise["slug"]: exercise["_id"] for exercise in exercises} == legacy_ids
+
+    data = shipped_catalog()
+    data["version"] += 1
+    data["exercises"][0]["default_rest"] = 45
+    assert await server.apply_exercise_catalog(write_catalog(tmp_path, data)) == 1
+    loaded = await server.load_changes(db, "exercises", server.SYNC_COLLECTIONS["exercises"][1], "u", 5, 100)
+    changes = server.sync_response({"exercises": loaded}, 5, 100)["changes"]["exercises"]
+    assert len(changes["inserted"]) == 0
+    assert len(changes["updated"]) == 5
@@ -0,0 +1,16 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_compressed_responses_get_their_own_strong_etag(api):
+    identity = await api.get("/api/exercises", headers={"Accept-Encoding": "identity"})
+    compressed = await api.get("/api/exercises", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["etag"] == identity.headers["etag"][:-1] + '-gzip"'
+    assert compressed.json() == identity.json()
+
+    for etag in (identity.headers["etag"], compressed.headers["etag"]):
+        revalidated = await api.get("/api/exercises", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        assert revalidated.status_code == 304
+        assert revalidated.headers["etag"] == etag
@@ -0,0 +1,80 @@
+import pytest
+from pymongo.errors import AutoReconnect
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+ALICE = {"X-User-Id": "alice"}
+BOB = {"X-User-Id": "bob"}
+
+
+def workout(workout_id):
+    return {"id": workout_id, "date": "2024-05-01", "exercises_completed": [], "total_duration": 60}
+
+
+async def total_sessions(api, headers=ALICE):
+    return (await api.get("/api/workouts/stats", headers=headers)).json()["total_sessions"]
+
+
+async def test_retried_workout_post_is_idempotent(api):
+    first = await api.post("/api/workouts", json=workout("w1"), headers=ALICE)
+    retry = await api.post("/api/workouts", json=workout("w1"), headers=ALICE)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json()["id"] == "w1"
+    assert retry.json()["stats"]["total_sessions"] == 1
+    assert await total_sessions(api) == 1
+
+    assert (await api.post("/api/workouts", json=workout("w1"), headers=BOB)).status_code == 409
+    assert await total_sessions(api, BOB) == 0
+
+
+async def test_retried_measurement_post_is_idempotent(api):
+    measurement = {"id": "m1", "date": "2024-05-01", "measurement": 80}
+    assert (await api.post("/api/measurements", json=measurement, headers=ALICE)).status_code == 200
+    retry = await api.post("/api/measurements", json={**measurement, "measurement": 79}, headers=ALICE)
+    assert retry.status_code == 200
+    assert retry.json()["measurement"] == 80
+    assert (await api.post("/api/measurements", json=measurement, headers=BOB)).status_code == 409
+
+
+async def test_workout_stored_by_an_interrupted_post_is_applied_on_retry(api, db):
+    await db.workout_sessions.insert_one({
+        **server.to_document(server.WorkoutSession(**workout("w1")), "alice"), server.UNAPPLIED_FIELD: True,
+    })
+    response = await api.post("/api/workouts", json=workout("w1"), headers=ALICE)
+    assert response.json()["stats"]["total_sessions"] == 1
+    await api.post("/api/workouts", json=workout("w1"), headers=ALICE)
+    assert await total_sessions(api) == 1
+
+
+async def test_bulk_retry_after_interrupted_insert_applies_every_session(api, db, monkeypatch):
+    items = [workout(f"w{i}") for i in range(3)]
+    collection_type = type(db.workout_sessions)
+    insert_many = collection_type.insert_many
+
+    async def interrupted_insert_many(self, documents, **kwargs):
+        await insert_many(self, documents[:2], **kwargs)
+        raise AutoReconnect("connection reset")
+
+    monkeypatch.setattr(collection_type, "insert_many", interrupted_insert_many)
+    with pytest.raises(AutoReconnect):
+        await api.post("/api/workouts/bulk", json=items, headers=ALICE)
+    monkeypatch.setattr(collection_type, "insert_many", insert_many)
+
+    retry = (await api.post("/api/workouts/bulk", json=items, headers=ALICE)).json()
+    assert (retry["created"], retry["duplicates"]) == (3, 0)
+    assert await total_sessions(api) == 3
+    assert await db.workout_sessions.count_documents({server.UNAPPLIED_FIELD: {"$exists": True}}) == 0
+
+    again = (await api.post("/api/workouts/bulk", json=items, headers=ALICE)).json()
+    assert (again["created"], again["duplicates"]) == (0, 3)
+    assert await total_sessions(api) == 3
+
+
+async def test_bulk_ids_owned_by_another_user_are_conflicts(api):
+    await api.post("/api/workouts/bulk", json=[workout("w1")], headers=ALICE)
+    result = (await api.post("/api/workouts/bulk", json=[workout("w1"), workout("w2")], headers=BOB)).json()
+    assert (result["created"], result["duplicates"], result["conflicts"]) == (1, 0, 1)
+    assert [item["status"] for item in result["results"]] == ["conflict", "created"]
+    assert await total_sessions(api, BOB) == 1
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_compact_migration_keeps_profiles_with_unique_user_id_index(db):
+    # Indexes as created by the releases before the compact layout
+    await db.user_profiles.create_index([("id", ASCENDING)], unique=True)
+    await db.user_profiles.create_index([("user_id", ASCENDING)], unique=True)
+    await db.user_profiles.insert_one({
+        "_id": ObjectId(),
+        "id": "profile-1",
+        "user_id": "default",
+        "age": 31,
+        "fitness_level": "beginner",
+        "goals": [],
+        "preferred_duration": 30,
+        "created_at": "2024-01-01T00:00:00+00:00",
+        "updated_at": "2024-01-02T00:00:00+00:00",
+    })
+
+    assert await server.migrate_compact_documents() == 1
+
+    profiles = await db.user_profiles.find({}).to_list(length=None)
+    assert len(profiles) == 1
+    assert profiles[0]["_id"] == "profile-1"
+    assert "id" not in profiles[0]
+    assert profiles[0]["created_at"] == datetime(2024, 1, 1, tzinfo=timezone.utc)
+    indexes = await db.user_profiles.index_information()
+    assert indexes["user_id_1"]["unique"]
+    assert "id_1" not in indexes
+
+
+async def test_sync_sequence_migration_stamps_every_document_once(db, monkeypatch):
+    monkeypatch.setattr(server, "MIGRATION_BATCH_SIZE", 3)
+    await db.workout_sessions.insert_many([{"_id": f"s{i:02d}", "user_id": "u"} for i in range(10)])
+    await db.workout_sessions.update_one({"_id": "s04"}, {"$set": {"seq": 1}})
+    await db.metadata.insert_one({"_id": server.SYNC_SEQUENCE_ID, "seq": 1})
+
+    assert await server.migrate_sync_sequences() == 9
+
+    sessions = await db.workout_sessions.find({}).to_list(length=None)
+    seqs = [session["seq"] for session in sessions]
+    assert len(set(seqs)) == 10
+    assert next(session["seq"] for session in sessions if session["_id"] == "s04") == 1
+    assert await server.migrate_sync_sequences() == 0
+
+
+async def test_workers_starting_at_once_run_each_migration_once(db, monkeypatch):
+    monkeypatch.setattr(server, "MIGRATION_WAIT_SECONDS", 0.01)
+    calls = []
+
+    async def migration():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+
+    monkeypatch.setattr(server, "MIGRATIONS", [(1, migration)])
+    assert sorted(await asyncio.gather(*(server.run_migrations() for _ in range(3)))) == [0, 0, 1]
+    assert calls == [1]
+    assert await db.metadata.find_one({"_id": server.MIGRATION_LEASE_ID}) is None
+
+
+async def test_expired_migration_lease_is_taken_over(db):
+    await db.metadata.insert_one({
+        "_id": server.MIGRATION_LEASE_ID, "owner": "crashed", "expires_at": datetime(2024, 1, 1, tzinfo=timezone.utc),
+    })
+    assert await server.run_migrations() == len(server.MIGRATIONS)
+    assert await server.schema_version() == server.MIGRATIONS[-1][0]
+
+
+async def test_dropping_an_index_that_is_already_gone_is_ignored(db, monkeypatch):
+    await db.measurements.create_index([("id", ASCENDING)], unique=True)
+    collection_type = type(db.measurements)
+
+    async def already_dropped(self, name):
+        raise OperationFailure("index not found", code=server.INDEX_NOT_FOUND_ERROR)
+
+    monkeypatch.setattr(collection_type, "drop_index", already_dropped)
+    await server.drop_legacy_id_indexes(db.measurements)
+    assert await server.drop_unique_indexes(db.measurements)
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+
+async def seed_workouts(api):
+    # Three sessions share each timestamp, so pages have to break ties on id
+    items = [
+        {"id": f"w{i:02d}", "date": "2024-05-01", "exercises_completed": [], "total_duration": 60,
+         "created_at": (START + timedelta(hours=i // 3)).isoformat()}
+        for i in range(12)
+    ]
+    response = await api.post("/api/workouts/bulk", json=items)
+    assert response.status_code == 200
+    return items
+
+
+async def read_pages(api, limit, **params):
+    ids, cursor, pages = [], None, 0
+    while True:
+        query = {"limit": limit, **params, **({"cursor": cursor} if cursor else {})}
+        response = await api.get("/api/workouts", params=query)
+        assert response.status_code == 200
+        ids.extend(session["id"] for session in response.json())
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return ids, pages
+
+
+async def test_keyset_pages_cover_every_session_once_in_order(api):
+    items = await seed_workouts(api)
+    expected = [item["id"] for item in sorted(items, key=lambda i: (i["created_at"], i["id"]), reverse=True)]
+
+    ids, pages = await read_pages(api, limit=5)
+    assert ids == expected
+    assert pages == 3
+
+
+async def test_keyset_pages_respect_date_range(api):
+    await seed_workouts(api)
+    ids, _ = await read_pages(
+        api, limit=2, **{"from": (START + timedelta(hours=1)).isoformat(), "to": (START + timedelta(hours=3)).isoformat()}
+    )
+    assert ids == ["w08", "w07", "w06", "w05", "w04", "w03"]
+
+
+async def test_invalid_cursor_is_rejected(api):
+    response = await api.get("/api/workouts", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
@@ -0,0 +1,46 @@
+import pytest
+
+import server
+from server import Exercise, ExerciseLevel, ExerciseType, PlanIndex
+
+pytestmark = pytest.mark.anyio
+
+
+def exercise(exercise_id, equipment, exercise_type=ExerciseType.ABDOMINAL):
+    return Exercise(
+        id=exercise_id, name=exercise_id, description="", video_url="", exercise_type=exercise_type,
+        level=ExerciseLevel.BEGINNER, default_duration=30, default_rest=30, instructions=[], muscle_groups=[],
+        equipment=equipment,
+    )
+
+
+def plan_ids(index, equipment, duration_minutes=30):
+    plan = server.generate_plan(
+        index, ExerciseLevel.BEGINNER, equipment, duration_minutes, goals=[], exercise_types=None, last_performed={},
+    )
+    return sorted(item.exercise_id for item in plan.items)
+
+
+def test_plans_skip_exercises_needing_equipment_the_user_lacks():
+    index = PlanIndex([
+        exercise("crunch", []),
+        exercise("mat_crunch", ["Colchoneta"]),
+        exercise("weighted_crunch", ["mancuernas", "colchoneta"]),
+    ])
+    assert plan_ids(index, ["yoga mat"]) == ["crunch", "mat_crunch"]
+    assert plan_ids(index, ["dumbbells", "mat"]) == ["crunch", "mat_crunch", "weighted_crunch"]
+    # No equipment given means the user hasn't said, so nothing is filtered
+    assert plan_ids(index, None) == plan_ids(index, []) == ["crunch", "mat_crunch", "weighted_crunch"]
+
+
+def test_plan_is_empty_when_no_exercise_fits_the_equipment():
+    index = PlanIndex([exercise("bench_press", ["banco", "barra"], ExerciseType.PECTORAL)])
+    assert plan_ids(index, ["banco"]) == []
+    assert plan_ids(index, ["kettlebell"]) == []
+
+
+async def test_plan_duration_must_be_positive(api):
+    assert (await api.post("/api/plans/generate", json={"duration": 0})).status_code == 422
+    response = await api.post("/api/plans/generate", json={"duration": 1})
+    assert response.status_code == 200
+    assert response.json()["duration_budget"] == 60
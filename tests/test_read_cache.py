@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class Loader:
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return {"call": self.calls}
+
+
+async def test_concurrent_identical_reads_share_one_load():
+    cache = server.ReadCache(ttl=60)
+    loader = Loader()
+    readers = [asyncio.create_task(cache.get("u", "route", loader, view="full")) for _ in range(10)]
+    await asyncio.sleep(0)
+    loader.release.set()
+
+    assert await asyncio.gather(*readers) == [{"call": 1}] * 10
+    assert loader.calls == 1
+    assert await cache.get("u", "route", loader, view="full") == {"call": 1}
+    counters = cache.snapshot()["routes"]["route"]
+    assert (counters["misses"], counters["coalesced"], counters["hits"]) == (1, 9, 1)
+
+
+async def test_different_params_and_scopes_load_separately():
+    cache = server.ReadCache(ttl=60)
+    loader = Loader()
+    loader.release.set()
+    await cache.get("u", "route", loader, view="full")
+    await cache.get("u", "route", loader, view="summary")
+    await cache.get("v", "route", loader, view="full")
+    assert loader.calls == 3
+
+
+async def test_cancelled_caller_does_not_cancel_the_shared_load():
+    cache = server.ReadCache(ttl=60)
+    loader = Loader()
+    first = asyncio.create_task(cache.get("u", "route", loader))
+    second = asyncio.create_task(cache.get("u", "route", loader))
+    await asyncio.sleep(0)
+    first.cancel()
+    loader.release.set()
+    assert await second == {"call": 1}
+    assert loader.calls == 1
+
+
+async def test_invalidation_during_a_load_keeps_the_result_out_of_the_cache():
+    cache = server.ReadCache(ttl=60)
+    loader = Loader()
+    reader = asyncio.create_task(cache.get("u", "route", loader))
+    await asyncio.sleep(0)
+    cache.invalidate("u")
+    loader.release.set()
+    assert await reader == {"call": 1}
+
+    assert await cache.get("u", "route", loader) == {"call": 2}
+    assert await cache.get("u", "route", loader) == {"call": 2}
+
+
+async def test_entries_expire_after_the_ttl():
+    cache = server.ReadCache(ttl=0)
+    loader = Loader()
+    loader.release.set()
+    await cache.get("u", "route", loader)
+    await cache.get("u", "route", loader)
+    assert loader.calls == 2
+
+
+async def test_writes_invalidate_cached_stats(api):
+    workout = {"date": "2024-05-01", "exercises_completed": [], "total_duration": 60}
+    assert (await api.get("/api/workouts/stats")).json()["total_sessions"] == 0
+    await api.post("/api/workouts", json=workout)
+    assert (await api.get("/api/workouts/stats")).json()["total_sessions"] == 1
+    assert server.read_cache.snapshot()["routes"]["workout_stats"]["invalidations"] >= 1
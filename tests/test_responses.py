@@ -0,0 +1,52 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+ROUTES = [
+    "/api/exercises",
+    "/api/exercises?view=summary",
+    "/api/exercises?exercise_type=abdominal",
+    "/api/exercises/search?q=abdominal",
+    "/api/workouts",
+    "/api/measurements",
+    "/api/dashboard",
+]
+
+
+async def test_fast_path_matches_strict_responses(api, monkeypatch):
+    exercise = (await api.get("/api/exercises")).json()[0]
+    for energy in (2, 4):
+        response = await api.post("/api/workouts", json={
+            "date": "2024-05-01",
+            "exercises_completed": [{"exercise_id": exercise["id"], "total_duration": 60, "sets_completed": 2}],
+            "total_duration": 60,
+            "energy_level": energy,
+        })
+        assert response.status_code == 200
+    await api.post("/api/measurements", json={"date": "2024-05-01", "measurement": 81.5})
+    routes = [*ROUTES, f"/api/exercises/{exercise['id']}"]
+
+    fast = {route: (await api.get(route)).json() for route in routes}
+    monkeypatch.setattr(server, "STRICT_RESPONSES", True)
+    server.read_cache.clear()
+    strict = {route: (await api.get(route)).json() for route in routes}
+
+    for route in routes:
+        assert fast[route] == strict[route], route
+
+
+async def test_bulk_items_are_validated_once(api, monkeypatch):
+    validate = server.WorkoutSession.model_validate.__func__
+    calls = []
+
+    def counting_validate(cls, *args, **kwargs):
+        calls.append(cls)
+        return validate(cls, *args, **kwargs)
+
+    monkeypatch.setattr(server.WorkoutSession, "model_validate", classmethod(counting_validate))
+    items = [{"date": "2024-05-01", "exercises_completed": [], "total_duration": 60} for _ in range(3)]
+    response = await api.post("/api/workouts/bulk", json=items)
+    assert response.json()["created"] == 3
+    assert len(calls) == 3
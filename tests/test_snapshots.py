@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def session_document(seq, stamped_ago=timedelta(0)):
+    now = datetime.now(timezone.utc)
+    return {
+        "_id": f"s{seq}", "user_id": "u", "created_at": now - timedelta(days=seq), "total_duration": 60,
+        "exercises_completed": [{"exercise_id": "e1"}], "seq": seq, "seq_at": now - stamped_ago,
+    }
+
+
+@pytest.fixture
+def store(db, tmp_path, monkeypatch):
+    store = server.ColumnarSnapshotStore(tmp_path)
+    monkeypatch.setattr(server, "snapshot_store", store)
+    return store
+
+
+async def snapshot_rows():
+    columns = await server.load_snapshot_columns("u")
+    return len(columns["created_at"])
+
+
+async def test_snapshot_catches_up_with_sessions_missed_by_the_build(db, store):
+    settled = timedelta(seconds=server.SYNC_SETTLE + 1)
+    sessions = [session_document(seq, settled) for seq in (1, 2, 3)]
+    await db.workout_sessions.insert_many(sessions)
+    # A session inserted after the build queried Mongo but before it wrote the snapshot
+    await db.workout_sessions.insert_one(session_document(4))
+    store.build("u", sessions, server.settled_high_water(sessions))
+
+    assert await snapshot_rows() == 4
+    assert await snapshot_rows() == 4
+
+
+async def test_snapshot_picks_up_inserts_that_land_out_of_sequence_order(db, store):
+    await db.workout_sessions.insert_many([session_document(1), session_document(3)])
+    assert await snapshot_rows() == 2
+
+    # seq 2 was allocated before seq 3 but its insert landed later
+    await db.workout_sessions.insert_one(session_document(2))
+    assert await snapshot_rows() == 3
+    assert await snapshot_rows() == 3
+    assert store.high_water("u") == 0
+
+
+async def test_rebuild_leaves_mapped_columns_of_the_previous_generation_intact(db, store):
+    settled = timedelta(seconds=server.SYNC_SETTLE + 1)
+    sessions = [session_document(seq, settled) for seq in (1, 2, 3)]
+    store.build("u", sessions, server.settled_high_water(sessions))
+    before = store.load("u")
+    durations = before["total_duration"].tolist()
+
+    store.build("u", sessions[:1], server.settled_high_water(sessions[:1]))
+
+    assert before["total_duration"].tolist() == durations
+    assert len(store.load("u")["created_at"]) == 1
+    directory = store.user_dir("u")
+    assert sorted(path.name for path in directory.glob("*.bin")) == sorted(
+        f"{name}.2.bin" for name in [*server.SNAPSHOT_ROW_COLUMNS, "exercise_offsets", "exercise_codes"]
+    )
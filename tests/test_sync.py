@@ -0,0 +1,90 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def workout(workout_id):
+    return {"id": workout_id, "date": "2024-05-01", "exercises_completed": [], "total_duration": 60}
+
+
+async def sync(api, since, **params):
+    response = await api.get("/api/sync", params={"since": since, **params})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["token"] >= since
+    return body
+
+
+async def current_token(api, monkeypatch):
+    monkeypatch.setattr(server, "SYNC_SETTLE", 0)
+    return (await sync(api, 0))["token"]
+
+
+def ids(body, name, kind="inserted"):
+    return [record["id"] for record in body["changes"][name][kind]]
+
+
+async def test_paging_with_a_limit_returns_every_change_once(api, monkeypatch):
+    token = await current_token(api, monkeypatch)
+    await api.post("/api/workouts/bulk", json=[workout(f"w{i}") for i in range(5)])
+
+    pages = []
+    has_more = True
+    while has_more:
+        body = await sync(api, token, limit=2)
+        assert body["token"] > token
+        token, has_more = body["token"], body["has_more"]
+        pages.append(ids(body, "workouts"))
+    assert pages == [["w0", "w1"], ["w2", "w3"], ["w4"]]
+    assert await sync(api, token) == {**body, "has_more": False, "changes": {
+        name: {"inserted": [], "updated": [], "deleted": []} for name in server.SYNC_COLLECTIONS
+    }}
+
+
+async def test_changes_inside_the_settle_window_are_sent_again(api, monkeypatch):
+    token = await current_token(api, monkeypatch)
+    monkeypatch.setattr(server, "SYNC_SETTLE", 3600)
+    await api.post("/api/workouts", json=workout("w1"))
+
+    first = await sync(api, token)
+    assert ids(first, "workouts") == ["w1"]
+    assert first["token"] == token
+    second = await sync(api, first["token"])
+    assert ids(second, "workouts") == ["w1"]
+
+    monkeypatch.setattr(server, "SYNC_SETTLE", 0)
+    settled = await sync(api, second["token"])
+    assert ids(settled, "workouts") == ["w1"]
+    assert settled["token"] > token
+    assert ids(await sync(api, settled["token"]), "workouts") == []
+
+
+async def test_unsettled_backlog_pages_forward(api, monkeypatch):
+    token = await current_token(api, monkeypatch)
+    monkeypatch.setattr(server, "SYNC_SETTLE", 3600)
+    await api.post("/api/workouts/bulk", json=[workout(f"w{i}") for i in range(3)])
+
+    first = await sync(api, token, limit=2)
+    assert (ids(first, "workouts"), first["has_more"]) == (["w0", "w1"], True)
+    assert first["token"] > token
+    last = await sync(api, first["token"], limit=2)
+    assert (ids(last, "workouts"), last["has_more"]) == (["w2"], False)
+    # Nothing has settled, so the token holds where paging left it
+    assert last["token"] == first["token"]
+
+
+async def test_records_changed_after_the_cursor_come_back_as_updates(api, monkeypatch):
+    token = await current_token(api, monkeypatch)
+    await api.post("/api/profile", json={"age": 30})
+    first = await sync(api, token)
+    assert len(first["changes"]["profile"]["inserted"]) == 1
+
+    await api.post("/api/profile", json={"age": 31})
+    await api.post("/api/workouts", json=workout("w1"))
+    second = await sync(api, first["token"])
+    assert [profile["age"] for profile in second["changes"]["profile"]["updated"]] == [31]
+    assert second["changes"]["profile"]["inserted"] == []
+    assert ids(second, "workouts") == ["w1"]
+    assert second["token"] > first["token"]
@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def session_document(i):
+    return {
+        "_id": f"s{i}", "user_id": server.DEFAULT_USER_ID, "date": "d", "exercises_completed": [],
+        "total_duration": 60, "energy_level": 3, "created_at": datetime.now(timezone.utc),
+    }
+
+
+async def test_trends_follow_writes_from_other_workers(api, db, monkeypatch):
+    monkeypatch.setattr(server.data_versions, "ttl", 0)
+    await db.workout_sessions.insert_many([session_document(i) for i in range(7)])
+    response = await api.get("/api/trends")
+    assert sum(period["sessions"] for period in response.json()["periods"]) == 7
+
+    # Another worker inserts a session and bumps the version stamp; this process's caches are not told
+    await db.workout_sessions.insert_one(session_document(7))
+    await db.data_versions.update_one({"_id": server.DEFAULT_USER_ID}, {"$inc": {"version": 1}}, upsert=True)
+
+    response = await api.get("/api/trends")
+    assert sum(period["sessions"] for period in response.json()["periods"]) == 8
+
+
+async def test_series_follow_writes_from_other_workers(api, db, monkeypatch):
+    monkeypatch.setattr(server.data_versions, "ttl", 0)
+    await db.workout_sessions.insert_many([session_document(i) for i in range(7)])
+    response = await api.get("/api/series/total_duration")
+    assert response.json()["total_points"] == 7
+
+    await db.workout_sessions.insert_one(session_document(7))
+    await db.data_versions.update_one({"_id": server.DEFAULT_USER_ID}, {"$inc": {"version": 1}}, upsert=True)
+
+    response = await api.get("/api/series/total_duration")
+    assert response.json()["total_points"] == 8
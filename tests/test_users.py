@@ -0,0 +1,61 @@
+from datetime import datetime, timezone
+
+import jwt
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+ALICE = {"X-User-Id": "alice"}
+BOB = {"X-User-Id": "bob"}
+
+
+async def test_user_data_is_isolated(api):
+    workout = {"date": "2024-05-01", "exercises_completed": [], "total_duration": 60}
+    assert (await api.post("/api/workouts", json=workout, headers=ALICE)).status_code == 200
+    assert (await api.post("/api/measurements", json={"date": "2024-05-01", "measurement": 80}, headers=ALICE)).status_code == 200
+    assert (await api.post("/api/profile", json={"age": 31}, headers=ALICE)).status_code == 200
+
+    assert len((await api.get("/api/workouts", headers=ALICE)).json()) == 1
+    assert (await api.get("/api/workouts/stats", headers=ALICE)).json()["total_sessions"] == 1
+    assert (await api.get("/api/profile", headers=ALICE)).json()["age"] == 31
+
+    assert (await api.get("/api/workouts", headers=BOB)).json() == []
+    assert (await api.get("/api/measurements", headers=BOB)).json() == []
+    assert (await api.get("/api/workouts/stats", headers=BOB)).json()["total_sessions"] == 0
+    assert (await api.get("/api/profile", headers=BOB)).json() is None
+    assert (await api.get("/api/workouts")).json() == []
+
+    stored = await server.db.workout_sessions.find_one({})
+    assert stored["user_id"] == "alice"
+    assert "user_id" not in (await api.get("/api/workouts", headers=ALICE)).json()[0]
+
+
+async def test_bearer_tokens_are_required_with_jwt_secret(api, monkeypatch):
+    monkeypatch.setattr(server, "JWT_SECRET", "secret")
+    assert (await api.get("/api/workouts")).status_code == 401
+    assert (await api.get("/api/workouts", headers={"Authorization": "Bearer nonsense"})).status_code == 401
+
+    token = jwt.encode({"sub": "carol"}, "secret", algorithm="HS256")
+    headers = {"Authorization": f"Bearer {token}", "X-User-Id": "alice"}
+    workout = {"date": "2024-05-01", "exercises_completed": [], "total_duration": 60}
+    assert (await api.post("/api/workouts", json=workout, headers=headers)).status_code == 200
+    assert (await server.db.workout_sessions.find_one({}))["user_id"] == "carol"
+
+
+async def test_legacy_documents_belong_to_the_default_user(db):
+    await db.workout_sessions.insert_one({"_id": "legacy", "created_at": "2024-01-01T00:00:00+00:00"})
+    await server.assign_default_user()
+    assert (await db.workout_sessions.find_one({"_id": "legacy"}))["user_id"] == server.DEFAULT_USER_ID
+
+
+async def test_only_the_latest_legacy_profile_is_kept(db):
+    await db.user_profiles.insert_many([
+        {"_id": "old", "age": 30, "updated_at": datetime(2024, 1, 1, tzinfo=timezone.utc)},
+        {"_id": "new", "age": 31, "updated_at": datetime(2024, 6, 1, tzinfo=timezone.utc)},
+    ])
+    await server.assign_default_user()
+    await server.ensure_indexes()
+    profiles = await db.user_profiles.find({}).to_list(length=None)
+    assert [(profile["_id"], profile["user_id"]) for profile in profiles] == [("new", server.DEFAULT_USER_ID)]
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_rebuild_replaces_rollups_in_place(db):
+    now = datetime.now(timezone.utc)
+    await db.workout_sessions.insert_many([
+        {"_id": f"s{i}", "user_id": user_id, "created_at": now - timedelta(days=i), "total_duration": 60}
+        for i, user_id in enumerate(["a", "a", "b"])
+    ])
+    # A rollup upserted by a session recorded while the rebuild runs, and one for a user with no sessions left
+    await db.workout_stats.insert_many([
+        {"_id": "a", "total_sessions": 1, "total_duration": 60, "daily": {}},
+        {"_id": "gone", "total_sessions": 3, "total_duration": 90, "daily": {}},
+    ])
+
+    await server.rebuild_workout_stats()
+
+    rollups = {rollup["_id"]: rollup for rollup in await db.workout_stats.find({}).to_list(length=None)}
+    assert set(rollups) == {"a", "b"}
+    assert (rollups["a"]["total_sessions"], rollups["a"]["total_duration"]) == (2, 120)
+    assert (rollups["b"]["total_sessions"], rollups["b"]["total_duration"]) == (1, 60)
+    assert await server.verify_workout_stats() == {}
+
+
+async def test_recording_drops_daily_buckets_older_than_the_window(db):
+    now = datetime.now(timezone.utc)
+    old_day = server.stats_day(now - timedelta(days=100))
+    await db.workout_stats.insert_one({
+        "_id": "a", "total_sessions": 1, "total_duration": 60,
+        "daily": {old_day: {"sessions": 1, "duration": 60}},
+    })
+    workouts = [
+        server.WorkoutSession(date="d", exercises_completed=[], total_duration=30, created_at=now),
+        server.WorkoutSession(date="d", exercises_completed=[], total_duration=30, created_at=now - timedelta(days=95)),
+    ]
+
+    rollup = await server.record_workout_stats("a", workouts)
+
+    assert list(rollup["daily"]) == [server.stats_day(now)]
+    assert (rollup["total_sessions"], rollup["total_duration"]) == (3, 120)
+    stored = await db.workout_stats.find_one({"_id": "a"})
+    assert list(stored["daily"]) == [server.stats_day(now)]
+
+
+async def test_exercise_stats_rebuild_replaces_documents_in_place(db):
+    await server.ensure_indexes()
+    now = datetime.now(timezone.utc)
+    await db.workout_sessions.insert_many([
+        {"_id": "s1", "user_id": "a", "created_at": now,
+         "exercises_completed": [{"exercise_id": "squat", "repetitions": 10, "sets": 2}]},
+        {"_id": "s2", "user_id": "b", "created_at": now,
+         "exercises_completed": [{"exercise_id": "plank", "total_duration": 60}]},
+    ])
+    # Stats written by a concurrent session, one for an exercise the user no longer has and one for a user with none
+    await db.exercise_stats.insert_many([
+        {"user_id": "a", "exercise_id": "squat", "count": 1},
+        {"user_id": "a", "exercise_id": "lunge", "count": 1},
+        {"user_id": "gone", "exercise_id": "squat", "count": 1},
+    ])
+
+    await server.rebuild_exercise_stats()
+
+    stats = {
+        (doc["user_id"], doc["exercise_id"]): doc
+        for doc in await db.exercise_stats.find({}).to_list(length=None)
+    }
+    assert set(stats) == {("a", "squat"), ("b", "plank")}
+    assert (stats["a", "squat"]["count"], stats["a", "squat"]["total_repetitions"]) == (1, 20)
+    assert stats["b", "plank"]["total_seconds"] == 60
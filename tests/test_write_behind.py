@@ -0,0 +1,56 @@
+import pytest
+from pymongo.errors import AutoReconnect
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def queued(user_id="u"):
+    workout = server.WorkoutSession(date="2024-05-01", exercises_completed=[], total_duration=60)
+    return user_id, workout, server.to_document(workout, user_id)
+
+
+@pytest.fixture
+def buffer():
+    return server.WriteBehindBuffer(max_queue=10, batch_size=10, flush_interval=0.01, put_timeout=1)
+
+
+async def test_retry_after_partial_insert_records_every_session(db, buffer, monkeypatch):
+    batch = [queued() for _ in range(3)]
+    # A session the client already sent once: a genuine duplicate
+    duplicate = queued()
+    await db.workout_sessions.insert_one({**duplicate[2], "seq": 0})
+    batch.append(duplicate)
+
+    collection_type = type(db.workout_sessions)
+    insert_many = collection_type.insert_many
+    calls = []
+
+    async def flaky_insert_many(self, documents, **kwargs):
+        calls.append(len(documents))
+        if len(calls) == 1:
+            await insert_many(self, documents[:2], **kwargs)
+            raise AutoReconnect("connection reset")
+        return await insert_many(self, documents, **kwargs)
+
+    monkeypatch.setattr(collection_type, "insert_many", flaky_insert_many)
+    await buffer._flush(batch)
+
+    assert len(calls) == 2
+    assert buffer.metrics["flushed"] == 3
+    assert buffer.metrics["duplicates"] == 1
+    assert buffer.metrics["dropped"] == 0
+    assert await db.workout_sessions.count_documents({}) == 4
+    rollup = await db.workout_stats.find_one({"_id": "u"})
+    assert rollup["total_sessions"] == 3
+
+
+async def test_failed_sequence_stamping_counts_the_batch_as_dropped(db, buffer, monkeypatch):
+    async def failing_allocate(count=1):
+        raise AutoReconnect("connection reset")
+
+    monkeypatch.setattr(server, "allocate_sequences", failing_allocate)
+    with pytest.raises(AutoReconnect):
+        await buffer._flush([queued(), queued()])
+    assert buffer.metrics["dropped"] == 2